@@ -0,0 +1,94 @@
+import json
+import shutil
+import subprocess
+from fractions import Fraction
+import pytest
+
+from util.ffmpeg_render import plan_segment, plan_timeline, render_stream_copy, run_ffmpeg, copy_piece, encode_piece, encode_still
+
+FPS = 25
+INFO = {"fps": Fraction(FPS), "duration": 20.0}
+KEYFRAMES = list(range(0, 20 * FPS, FPS))
+
+
+def frames_of(pieces):
+    return sum(frame_count for _, _, frame_count in pieces)
+
+
+def test_plan_segment_copies_whole_gops_and_encodes_the_edges():
+    assert plan_segment(10, 90, [0, 25, 50, 75, 100]) == [("encode", 10, 15), ("copy", 25, 50), ("encode", 75, 15)]
+
+
+def test_plan_segment_starting_on_keyframes_has_no_leading_edge():
+    assert plan_segment(25, 75, [0, 25, 50, 75, 100]) == [("copy", 25, 50)]
+
+
+def test_plan_segment_without_two_keyframes_is_encoded():
+    assert plan_segment(30, 70, [0, 50, 100]) == [("encode", 30, 40)]
+
+
+def test_stills_absorb_frame_rounding():
+    timeline = [("segment", 0, 3.01), ("still", "a.jpg", 1.53), ("segment", 3.01, 7.37), ("still", "b.jpg", 2.05), ("segment", 7.37, 20)]
+    pieces = plan_timeline("in.mp4", timeline, INFO, KEYFRAMES)
+    total_seconds = 3.01 + 1.53 + (7.37 - 3.01) + 2.05 + (20 - 7.37)
+    assert frames_of(pieces) == round(total_seconds * FPS)
+    stills = [piece for piece in pieces if piece[0] is encode_still]
+    assert [frame_count for _, _, frame_count in stills] == [39, 51]
+
+
+def test_reversed_segments_add_nothing():
+    # Timestamps [8, 6]: the segment from 8 back to 6 has no length in the soundtrack either
+    timeline = [("segment", 0, 8), ("still", "a.jpg", 2), ("segment", 8, 6), ("still", "b.jpg", 2), ("segment", 6, 20)]
+    pieces = plan_timeline("in.mp4", timeline, INFO, KEYFRAMES)
+    assert frames_of(pieces) == (8 + 2 + 2 + 14) * FPS
+    assert [frame_count for function, _, frame_count in pieces if function is encode_still] == [2 * FPS, 2 * FPS]
+
+
+def test_segment_past_the_end_is_absorbed_by_the_next_still():
+    timeline = [("segment", 0, 8), ("still", "a.jpg", 2), ("segment", 8, 25), ("still", "b.jpg", 2)]
+    pieces = plan_timeline("in.mp4", timeline, INFO, KEYFRAMES)
+    copied = [args for function, args, _ in pieces if function in (copy_piece, encode_piece)]
+    assert max(start + count for _, start, count in copied) == 20 * FPS
+    assert frames_of(pieces) == (8 + 2 + 17 + 2) * FPS
+
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None, reason="ffmpeg is not installed")
+
+
+def probe(path, *args):
+    result = subprocess.run(["ffprobe", "-v", "error", "-of", "json", *args, path], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+@pytest.fixture(scope="module")
+def source(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("render")
+    video_path = str(directory / "in.mp4")
+    run_ffmpeg([
+        "-f", "lavfi", "-i", f"testsrc=duration=6:size=320x240:rate={FPS}",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", "-g", str(FPS), "-keyint_min", str(FPS), "-sc_threshold", "0",
+        video_path,
+    ])
+    still_path = str(directory / "still.jpg")
+    run_ffmpeg(["-ss", "2", "-i", video_path, "-frames:v", "1", still_path])
+    audio_path = str(directory / "audio.wav")
+    run_ffmpeg(["-f", "lavfi", "-i", "sine=frequency=440:duration=7.5", "-ac", "2", "-ar", "44100", audio_path])
+    return directory, video_path, still_path, audio_path
+
+
+@needs_ffmpeg
+def test_render_stream_copy_output_decodes_cleanly(source):
+    directory, video_path, still_path, audio_path = source
+    output_path = str(directory / "out.mp4")
+    timeline = [("segment", 0, 2.3), ("still", still_path, 1.5), ("segment", 2.3, 6)]
+    render_stream_copy(video_path, timeline, audio_path, output_path, str(directory / "work"))
+
+    video = probe(output_path, "-count_frames", "-select_streams", "v:0", "-show_entries", "stream=nb_read_frames")["streams"][0]
+    assert int(video["nb_read_frames"]) == round(7.5 * FPS)
+    audio = probe(output_path, "-select_streams", "a:0", "-show_entries", "stream=duration")["streams"][0]
+    assert float(audio["duration"]) == pytest.approx(7.5, abs=0.05)
+
+    # Copied GOPs and re-encoded pieces carry their own parameter sets; a strict decode must not complain
+    result = subprocess.run(["ffmpeg", "-v", "error", "-xerror", "-i", output_path, "-f", "null", "-"], capture_output=True, text=True)
+    assert result.returncode == 0
+    assert result.stderr.strip() == ""
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import pytest
+
+from util.job_scheduler import PrioritySlots, JobScheduler, JobQueueFull
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_priority_slots_serve_lower_priority_first_then_in_arrival_order():
+    async def scenario():
+        slots = PrioritySlots(1)
+        order = []
+        await slots.acquire()
+
+        async def waiter(name, priority):
+            async with slots.slot(priority):
+                order.append(name)
+
+        tasks = [asyncio.ensure_future(waiter(name, priority)) for name, priority in [("late", 5), ("first", 0), ("second", 0)]]
+        await asyncio.sleep(0)
+        assert slots.waiting == 3
+        slots.release()
+        await asyncio.gather(*tasks)
+        return order, slots.in_use
+
+    order, in_use = run(scenario())
+    assert order == ["first", "second", "late"]
+    assert in_use == 0
+
+
+def test_priority_slots_limit_concurrency():
+    async def scenario():
+        slots = PrioritySlots(2)
+        active = {"now": 0, "max": 0}
+
+        async def job():
+            async with slots.slot():
+                active["now"] += 1
+                active["max"] = max(active["max"], active["now"])
+                await asyncio.sleep(0.01)
+                active["now"] -= 1
+
+        await asyncio.gather(*(job() for _ in range(6)))
+        return active["max"]
+
+    assert run(scenario()) == 2
+
+
+def test_cancelled_waiter_passes_its_slot_on():
+    async def scenario():
+        slots = PrioritySlots(1)
+        await slots.acquire()
+        cancelled = asyncio.ensure_future(slots.acquire())
+        queued = asyncio.ensure_future(slots.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        slots.release()
+        await queued
+        return slots.in_use, slots.waiting
+
+    assert run(scenario()) == (1, 0)
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = JobScheduler(active_slots=1, model_slots=1, render_slots=1, max_queue_depth=2, blocking_workers=2)
+    yield scheduler
+    scheduler.loop.call_soon_threadsafe(scheduler.loop.stop)
+
+
+def test_burst_admits_active_slots_plus_queue_depth(scheduler):
+    release = threading.Event()
+
+    async def job():
+        await asyncio.to_thread(release.wait)
+
+    futures = []
+    rejected = 0
+    for i in range(5):
+        try:
+            futures.append(scheduler.submit(f"job-{i}", job))
+        except JobQueueFull:
+            rejected += 1
+
+    # One job runs, two wait; the rest are turned away
+    assert (len(futures), rejected) == (3, 2)
+    assert scheduler.stats()["queue_depth"] == 2
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert scheduler.stats() == {"queue_depth": 0, "running": 0, "max_queue_depth": 2}
+
+
+def test_jobs_run_by_priority(scheduler):
+    release = threading.Event()
+    order = []
+
+    async def blocker():
+        await asyncio.to_thread(release.wait)
+
+    async def job(name):
+        order.append(name)
+
+    first = scheduler.submit("blocker", blocker)
+    futures = [scheduler.submit("low", job, "low", priority=5), scheduler.submit("high", job, "high", priority=0)]
+    release.set()
+    first.result(timeout=5)
+    for future in futures:
+        future.result(timeout=5)
+    assert order == ["high", "low"]
+
+
+def test_on_admitted_runs_before_the_job_and_only_for_admitted_jobs(scheduler):
+    release = threading.Event()
+    events = []
+
+    async def job(name):
+        events.append(f"{name} started")
+        await asyncio.to_thread(release.wait)
+
+    futures = [scheduler.submit(name, job, name, on_admitted=lambda name=name: events.append(f"{name} admitted")) for name in "abc"]
+    with pytest.raises(JobQueueFull):
+        scheduler.submit("d", job, "d", on_admitted=lambda: events.append("d admitted"))
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+
+    assert "d admitted" not in events
+    for name in "abc":
+        assert events.index(f"{name} admitted") < events.index(f"{name} started")
+
+
+def test_failed_on_admitted_gives_the_place_back(scheduler):
+    def fail():
+        raise OSError("store unavailable")
+
+    with pytest.raises(OSError):
+        scheduler.submit("a", asyncio.sleep, 0, on_admitted=fail)
+    assert scheduler.stats() == {"queue_depth": 0, "running": 0, "max_queue_depth": 2}
@@ -0,0 +1,133 @@
+import threading
+import time
+import pytest
+
+import util.job_store
+from util.job_store import JobStore, InMemoryJobStore, SQLiteJobStore, JobUpdates, JOB_PROCESSING, JOB_COMPLETED, JOB_FAILED
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteJobStore(path=str(tmp_path / "jobs.sqlite3"))
+    return InMemoryJobStore()
+
+
+class FlakyStore(InMemoryJobStore):
+    # Fails the first `failures` updates, and records every update that got through
+    def __init__(self, failures=0):
+        super().__init__()
+        self.failures = failures
+        self.updates = []
+
+    def update(self, job_id, **fields):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("store unavailable")
+        self.updates.append(fields)
+        return super().update(job_id, **fields)
+
+
+def test_job_store_needs_a_backend():
+    with pytest.raises(TypeError):
+        JobStore()
+
+
+def test_create_update_and_get(store):
+    job = store.create("a.mp4", "Processing")
+    assert job["state"] == JOB_PROCESSING and job["version"] == 1
+
+    store.update("a.mp4", stage="tts", progress=40)
+    job = store.update("a.mp4", stage="rendering", progress=60)
+
+    assert job["version"] == 3
+    assert store.get("a.mp4") == job
+    # Leaving a stage records how long it took
+    assert set(job["timings"]) == {"queued", "tts"}
+
+
+def test_update_of_unknown_job_is_ignored(store):
+    assert store.update("missing.mp4", progress=10) is None
+    assert store.get("missing.mp4") is None
+
+
+def test_wait_for_change_wakes_on_update(store):
+    job = store.create("a.mp4", "Processing")
+    threading.Timer(0.1, lambda: store.update("a.mp4", progress=50)).start()
+
+    start = time.monotonic()
+    changed = store.wait_for_change("a.mp4", job["version"], timeout=5)
+
+    assert changed["progress"] == 50
+    assert time.monotonic() - start < 2
+
+
+def test_wait_for_change_times_out_with_the_unchanged_job(store):
+    job = store.create("a.mp4", "Processing")
+    assert store.wait_for_change("a.mp4", job["version"], timeout=0.1)["version"] == job["version"]
+
+
+def test_sqlite_store_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    SQLiteJobStore(path=path).create("a.mp4", "Processing")
+    other = SQLiteJobStore(path=path)
+    other.update("a.mp4", state=JOB_COMPLETED)
+    assert SQLiteJobStore(path=path).get("a.mp4")["state"] == JOB_COMPLETED
+
+
+def test_expired_jobs_are_removed(tmp_path):
+    store = SQLiteJobStore(path=str(tmp_path / "jobs.sqlite3"), ttl_seconds=0.05)
+    store.create("old.mp4", "Processing")
+    time.sleep(0.1)
+    store.create("new.mp4", "Processing")
+    assert store.get("old.mp4") is None
+    assert store.get("new.mp4") is not None
+
+
+def test_progress_is_coalesced_per_stage():
+    store = FlakyStore()
+    store.create("a.mp4", "Processing")
+    updates = JobUpdates(store, "a.mp4", min_interval=0.2)
+
+    updates.report(stage="tts", progress=36)
+    time.sleep(0.05)
+    for progress in range(37, 60):
+        updates.report(stage="tts", progress=progress)
+    updates.report(stage="rendering", progress=60)
+    time.sleep(0.6)
+
+    assert store.updates == [{"stage": "tts", "progress": 36}, {"stage": "tts", "progress": 59}, {"stage": "rendering", "progress": 60}]
+    assert set(store.get("a.mp4")["timings"]) == {"queued", "tts"}
+
+
+def test_finish_writes_pending_progress_and_drops_later_reports():
+    store = FlakyStore()
+    store.create("a.mp4", "Processing")
+    updates = JobUpdates(store, "a.mp4", min_interval=0.2)
+
+    updates.report(stage="tts", progress=40)
+    updates.report(stage="tts", progress=50, status="Generating narration...")
+    updates.finish(state=JOB_COMPLETED, stage="done", progress=100)
+    updates.report(stage="rendering", progress=70)
+    time.sleep(0.3)
+
+    job = store.get("a.mp4")
+    assert (job["state"], job["stage"], job["progress"], job["status"]) == (JOB_COMPLETED, "done", 100, "Generating narration...")
+
+
+def test_finish_retries_until_the_store_recovers():
+    store = FlakyStore(failures=1)
+    store.create("a.mp4", "Processing")
+
+    JobUpdates(store, "a.mp4", min_interval=0).finish(state=JOB_FAILED, stage="failed", error="boom")
+
+    assert store.get("a.mp4")["state"] == JOB_FAILED
+
+
+def test_finish_raises_once_attempts_run_out(monkeypatch):
+    monkeypatch.setattr(util.job_store, "JOB_UPDATE_FINAL_ATTEMPTS", 1)
+    store = FlakyStore(failures=1)
+    store.create("a.mp4", "Processing")
+
+    with pytest.raises(OSError):
+        JobUpdates(store, "a.mp4", min_interval=0).finish(state=JOB_FAILED)
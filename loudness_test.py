@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from util.loudness import LoudnessIndex, normalization_gain
+
+SAMPLE_RATE = 1000
+HOP = 50
+
+
+@pytest.fixture
+def samples():
+    rng = np.random.default_rng(7)
+    # Not a whole number of windows, so the last window is padded
+    return (rng.standard_normal((10_037, 2)) * rng.uniform(0.01, 1.0, (10_037, 1))).astype(np.float32)
+
+
+def brute_force_windows(samples, start, end):
+    first = int(start * SAMPLE_RATE) // HOP
+    last = -(-int(end * SAMPLE_RATE) // HOP)
+    return samples[first * HOP:last * HOP]
+
+
+def test_peak_matches_brute_force(samples):
+    index = LoudnessIndex(samples, sample_rate=SAMPLE_RATE, hop_seconds=HOP / SAMPLE_RATE)
+    rng = np.random.default_rng(11)
+    for _ in range(200):
+        start, end = sorted(rng.uniform(0, index.duration, 2))
+        expected = brute_force_windows(samples, start, end)
+        assert index.peak(start, end) == pytest.approx(float(np.abs(expected).max()) if expected.size else 0.0)
+
+
+def test_rms_matches_brute_force_on_whole_windows(samples):
+    index = LoudnessIndex(samples, sample_rate=SAMPLE_RATE, hop_seconds=HOP / SAMPLE_RATE)
+    expected = brute_force_windows(samples, 1.0, 4.0)
+    assert index.rms_level(1.0, 4.0) == pytest.approx(float(np.sqrt(np.mean(np.square(expected, dtype=np.float64)))), rel=1e-5)
+
+
+def test_global_peak_and_open_ranges(samples):
+    index = LoudnessIndex(samples, sample_rate=SAMPLE_RATE, hop_seconds=HOP / SAMPLE_RATE)
+    assert index.global_peak == pytest.approx(float(np.abs(samples).max()))
+    assert index.peak() == index.global_peak
+    assert index.peak(5.0) == pytest.approx(float(np.abs(samples[5000:]).max()))
+
+
+def test_empty_ranges_and_tracks_are_silent(samples):
+    index = LoudnessIndex(samples, sample_rate=SAMPLE_RATE, hop_seconds=HOP / SAMPLE_RATE)
+    assert index.peak(4.0, 4.0) == 0.0
+    assert index.peak(20.0, 30.0) == 0.0
+    assert index.rms_level(3.0, 2.0) == 0.0
+    empty = LoudnessIndex(np.zeros((0, 2), dtype=np.float32), sample_rate=SAMPLE_RATE)
+    assert empty.global_peak == 0.0
+    assert empty.peak() == 0.0
+
+
+def test_normalization_gain():
+    assert normalization_gain(0.5, 0.25) == 0.5
+    assert normalization_gain(0.0, 0.25) == 1.0
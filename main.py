@@ -1,5 +1,6 @@
 from flask import Flask, request, jsonify, send_file, Response
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 import shutil
 from google.cloud import storage
@@ -7,19 +8,24 @@ import datetime
 from datetime import timedelta
 import logging
 import asyncio
+import threading
+import time
 from util.Constants import BUCKET_NAME
-from util.gcs_bucket import download_from_gcs, download_multiple_from_gcs, upload_to_gcs, get_storage_client
-from util.text_to_speech import main_function
+from util.gcs_bucket import download_from_gcs, download_multiple_from_gcs, upload_to_gcs, get_storage_client, get_bucket
+from util.upload_stream import stream_multipart_upload
+from util.input_cache import get_input_cache, input_cache_key
+from util.job_store import get_job_store, JobUpdates, JOB_PROCESSING, JOB_COMPLETED, JOB_FAILED
+from util.job_scheduler import get_job_scheduler, JobQueueFull
 import json
 from google.oauth2 import service_account
-processing_status = {}
 
 storage_client = get_storage_client()
 
 class VideoProcessRequest:
-    def __init__(self, video_path: str, add_bg_music: str):
+    def __init__(self, video_path: str, add_bg_music: str, on_progress=None):
         self.video_path = video_path
         self.add_bg_music = add_bg_music
+        self.on_progress = on_progress
 
 app = Flask(__name__)
 
@@ -30,8 +36,40 @@ app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB
 
 
 VIDDYSCRIBE_API_KEY = os.getenv("VIDDYSCRIBE_API_KEY")
+# Pipe /upload_video bodies straight into GCS instead of staging them in /tmp first
+STREAMING_UPLOAD = os.getenv("STREAMING_UPLOAD", "true") == "true"
 
-signed_urls = {}
+PROCESSING_MESSAGE = "Processing video... This may take 4-10 minutes. Keep this tab open."
+
+job_store = get_job_store()
+
+# Status requests that wait for a change hold a gunicorn thread, so only a few may wait at a time
+STATUS_WAIT_SLOTS = int(os.getenv("STATUS_WAIT_SLOTS", "4"))
+LONG_POLL_MAX_SECONDS = float(os.getenv("LONG_POLL_MAX_SECONDS", "25"))
+STATUS_STREAM_MAX_SECONDS = float(os.getenv("STATUS_STREAM_MAX_SECONDS", "300"))
+STATUS_STREAM_KEEPALIVE_SECONDS = 15
+STATUS_STREAM_RETRY_MS = 3000
+# How long clients are told to back off when every wait slot is taken
+STATUS_BUSY_RETRY_SECONDS = 15
+status_wait_slots = threading.BoundedSemaphore(STATUS_WAIT_SLOTS)
+
+# Import the processing pipeline (moviepy, vertexai, elevenlabs), set up the Gemini models and start
+# prefetching background music in the background, so a cold start can answer /get_upload_url before they have loaded
+WARMUP_ON_BOOT = os.getenv("WARMUP_ON_BOOT", "true") == "true"
+
+def warm_up():
+    try:
+        import util.text_to_speech
+        from util.gemini import get_vertex_utility
+        from util.music_library import get_music_catalog
+        get_vertex_utility()
+        get_music_catalog().start_prefetch()
+        logging.info("Processing pipeline warmed up")
+    except Exception as e:
+        logging.error(f"Warmup failed, it will be retried by the first job: {e}")
+
+if WARMUP_ON_BOOT:
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
 
 # Add CORS middleware
 from flask_cors import CORS
@@ -43,9 +81,37 @@ def verify_api_key():
         return jsonify({"detail": "Invalid API Key"}), 403
 
 
-from concurrent.futures import ThreadPoolExecutor
+job_scheduler = get_job_scheduler()
+
+schedule_lock = threading.Lock()
 
-executor = ThreadPoolExecutor()
+def schedule_job(gcs_url, add_bg_music, output_video_name, **fields):
+    # Returns an error response when the job can't be taken, None once it is queued. Nothing is written
+    # to the job store for a refused job, so a run already in flight under this name keeps its record
+    with schedule_lock:
+        existing = job_store.get(output_video_name)
+        if existing is not None and existing["state"] == JOB_PROCESSING:
+            logging.warning(f"Refused job {output_video_name}: already processing")
+            return job_running_response(output_video_name=output_video_name, **fields)
+        try:
+            # The record is created before the job can start, so none of its progress updates are lost
+            job_scheduler.submit(output_video_name, process_video_task, gcs_url, add_bg_music, output_video_name,
+                                 on_admitted=lambda: job_store.create(output_video_name, PROCESSING_MESSAGE))
+        except JobQueueFull as e:
+            logging.warning(f"Rejected job {output_video_name}: {e}")
+            return queue_full_response(output_video_name=output_video_name, **fields)
+    return None
+
+def queue_full_response(**fields):
+    response = jsonify({"detail": "Too many videos are being processed. Please try again in a few minutes.", **fields, **job_scheduler.stats()})
+    response.status_code = 429
+    response.headers["Retry-After"] = "60"
+    return response
+
+def job_running_response(**fields):
+    response = jsonify({"detail": "This video is already being processed.", **fields})
+    response.status_code = 409
+    return response
 
 @app.route("/upload_video", methods=["POST"])
 def upload_video():
@@ -54,34 +120,57 @@ def upload_video():
         return error_response
 
     try:
-        add_bg_music = True if request.form.get('add_bg_music') == "true" else False
-        print("Add bg music:"+str(add_bg_music))
-        file = request.files['file']
-        filename = secure_filename(file.filename)
-        file_location = f"/tmp/{filename}"
-        file.save(file_location)
-        
-        gcs_url = upload_to_gcs(BUCKET_NAME, file_location, filename)
-
-         # Clean up the temporary file
-        os.remove(file_location)
+        if STREAMING_UPLOAD:
+            # request.form/request.files must not be touched here, they would consume the stream
+            upload = stream_multipart_upload(request.stream, request.content_type, BUCKET_NAME)
+            add_bg_music = True if upload["fields"].get('add_bg_music') == "true" else False
+            logging.info(f"Add bg music: {add_bg_music}")
+            filename = upload["filename"]
+            gcs_url = filename
+            # The teed copy becomes the cached input for this object, so main_function won't download it again
+            get_input_cache().add(input_cache_key(BUCKET_NAME, filename, upload["md5_hash"]), upload["local_path"], move=True)
+        else:
+            add_bg_music = True if request.form.get('add_bg_music') == "true" else False
+            print("Add bg music:"+str(add_bg_music))
+            file = request.files['file']
+            filename = secure_filename(file.filename)
+            file_location = f"/tmp/{filename}"
+            file.save(file_location)
+            
+            gcs_url = upload_to_gcs(BUCKET_NAME, file_location, filename)
+
+             # Clean up the temporary file
+            os.remove(file_location)
 
         output_video_name = os.path.splitext(filename)[0] + "_output.mp4"
-        processing_status[output_video_name] = "Processing video... This may take 4-10 minutes. Keep this tab open."
-
-        # Schedule the task in a separate thread
-        executor.submit(asyncio.run, process_video_task(gcs_url, add_bg_music, output_video_name))
+        error_response = schedule_job(gcs_url, add_bg_music, output_video_name, gcs_url=gcs_url)
+        if error_response:
+            # The upload itself is kept, so the client can retry through /start_processing
+            return error_response
         
         return jsonify({"status": "processing", "gcs_url": gcs_url, "output_video_name": output_video_name})
+    except RequestEntityTooLarge:
+        return jsonify({"detail": "File too large"}), 413
+    except ValueError as e:
+        logging.error(f"Bad upload in /upload_video: {e}")
+        return jsonify({"detail": str(e)}), 400
     except Exception as e:
         logging.error(f"Error in /upload_video: {e}")
         return jsonify({"detail": "Internal Server Error"}), 500
 
 
 async def process_video_task(gcs_url: str, add_bg_music: str, output_video_name: str):
+    # Status writes block on SQLite or GCS, so none of them run on the scheduler's event loop: progress
+    # goes through the job's background writer, the final state through a worker thread
+    updates = JobUpdates(job_store, output_video_name)
     try:
         logging.info(f"Starting to process video: {gcs_url}")
-        request = VideoProcessRequest(video_path=gcs_url, add_bg_music=add_bg_music)
+        updates.report(stage="processing")
+
+        def on_progress(stage, progress, status):
+            updates.report(stage=stage, progress=round(progress, 1), status=status)
+
+        request = VideoProcessRequest(video_path=gcs_url, add_bg_music=add_bg_music, on_progress=on_progress)
         result = await process_video(request)
         
         if not isinstance(result, dict) or 'status' not in result:
@@ -89,30 +178,42 @@ async def process_video_task(gcs_url: str, add_bg_music: str, output_video_name:
 
         if result['status'] == 'error':
             logging.error(f"Error processing video: {result.get('message', 'Unknown error')}")
-            processing_status[output_video_name] = "Error processing video"
+            await asyncio.to_thread(updates.finish, state=JOB_FAILED, stage="failed", status="Error processing video", error=result.get('message'))
             return
 
         if 'output_url' not in result:
             logging.error("No output_url in result")
-            processing_status[output_video_name] = "Error processing video"
+            await asyncio.to_thread(updates.finish, state=JOB_FAILED, stage="failed", status="Error processing video", error="No output_url in result")
             return
 
         processed_video_filename = os.path.basename(result["output_url"])
-        bucket = storage_client.bucket(BUCKET_NAME)
+        bucket = get_bucket(BUCKET_NAME)
         blob = bucket.blob(processed_video_filename)
-        signed_url = blob.generate_signed_url(
+        signed_url = await asyncio.to_thread(
+            blob.generate_signed_url,
             version="v4",
             expiration=timedelta(minutes=15),
             method="GET"
         )
         
-        signed_urls[processed_video_filename] = signed_url
-        processing_status[output_video_name] = "Processing completed"
+        await asyncio.to_thread(
+            updates.finish,
+            state=JOB_COMPLETED,
+            stage="done",
+            progress=100,
+            status="Processing completed",
+            result_url=signed_url,
+            output_file=processed_video_filename,
+        )
         logging.info(f"Video processing completed: {output_video_name}")
         
     except Exception as e:
         logging.error(f"Error in process_video_task: {str(e)}")
-        processing_status[output_video_name] = "Error processing video"
+        try:
+            await asyncio.to_thread(updates.finish, state=JOB_FAILED, stage="failed", status="Error processing video", error=str(e))
+        except Exception as store_error:
+            # Nothing is left to report it to; log it here instead of losing it in the scheduler's future
+            logging.error(f"Could not record the failure of job {output_video_name}: {store_error}")
 
 @app.route("/start_processing", methods=["POST"])
 def start_processing():
@@ -131,10 +232,9 @@ def start_processing():
         # Remove the gs:// prefix if it exists
         gcs_url = filename if not filename.startswith('gs://') else filename[5:]
         output_video_name = os.path.splitext(filename)[0] + "_output.mp4"
-        processing_status[output_video_name] = "Processing video... This may take 4-10 minutes. Keep this tab open."
-
-        # Schedule the task in a separate thread
-        executor.submit(asyncio.run, process_video_task(gcs_url, add_bg_music, output_video_name))
+        error_response = schedule_job(gcs_url, add_bg_music, output_video_name)
+        if error_response:
+            return error_response
         
         return jsonify({"status": "processing", "output_video_name": output_video_name})
     except Exception as e:
@@ -163,7 +263,7 @@ def get_upload_url():
             logging.error(f"Missing filename or content_type. Filename: {filename}, Content-Type: {content_type}")
             return jsonify({"error": "Filename and content type are required"}), 400
 
-        bucket = storage_client.bucket(BUCKET_NAME)
+        bucket = get_bucket(BUCKET_NAME)
         blob = bucket.blob(filename)
 
         # Generate a signed URL for uploading
@@ -181,10 +281,85 @@ def get_upload_url():
         return jsonify({"error": "Internal Server Error", "details": str(e)}), 500
 
 
+def job_status(job):
+    return {
+        "status": job["status"],
+        "state": job["state"],
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "timings": job["timings"],
+        "queue_depth": job_scheduler.stats()["queue_depth"],
+    }
+
+def sse_event(job, retry_ms=None):
+    event = f"retry: {retry_ms}\n" if retry_ms else ""
+    return event + f"id: {job['version']}\ndata: {json.dumps(job_status(job))}\n\n"
+
 @app.route("/update_status/<output_video_name>", methods=["GET"])
 def update_status(output_video_name: str):
-    status = processing_status.get(output_video_name, "Processing video. This may take 4-10 minutes. Keep this tab open.")
-    return jsonify({"status": status})
+    # Long poll: with If-None-Match set to the last ETag and ?wait=<seconds>, the request is answered
+    # when the job changes, or with 304 once the wait is over. When no wait slot is free it is answered
+    # straight away with 503 and Retry-After, so clients back off instead of polling in a tight loop
+    job = job_store.get(output_video_name)
+    if job is None:
+        return jsonify({"detail": "Job not found"}), 404
+
+    etag = str(job["version"])
+    wait = min(request.args.get("wait", 0, type=float), LONG_POLL_MAX_SECONDS)
+    if request.if_none_match.contains(etag) and wait > 0 and job["state"] == JOB_PROCESSING:
+        if not status_wait_slots.acquire(blocking=False):
+            response = jsonify({"detail": "Too many status requests are waiting. Please retry later."})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(STATUS_BUSY_RETRY_SECONDS)
+            return response
+        try:
+            job = job_store.wait_for_change(output_video_name, job["version"], wait) or job
+        finally:
+            status_wait_slots.release()
+        etag = str(job["version"])
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(job_status(job))
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/status_stream/<output_video_name>", methods=["GET"])
+def status_stream(output_video_name: str):
+    # Server-sent events: one event per job update until the job finishes, closed after
+    # STATUS_STREAM_MAX_SECONDS so EventSource reconnects instead of pinning a thread for the whole job
+    job = job_store.get(output_video_name)
+    if job is None:
+        return jsonify({"detail": "Job not found"}), 404
+    # A finished job whose last event the client already has: 204 tells EventSource to stop reconnecting
+    if job["state"] != JOB_PROCESSING and request.headers.get("Last-Event-ID") == str(job["version"]):
+        return Response(status=204)
+
+    def generate():
+        # The slot is taken inside the generator so it is released however the stream ends
+        if not status_wait_slots.acquire(blocking=False):
+            yield sse_event(job, retry_ms=STATUS_BUSY_RETRY_SECONDS * 1000)
+            return
+        try:
+            current = job
+            deadline = time.monotonic() + STATUS_STREAM_MAX_SECONDS
+            yield sse_event(current, retry_ms=STATUS_STREAM_RETRY_MS)
+            while current["state"] == JOB_PROCESSING and time.monotonic() < deadline:
+                timeout = min(STATUS_STREAM_KEEPALIVE_SECONDS, deadline - time.monotonic())
+                latest = job_store.wait_for_change(output_video_name, current["version"], timeout)
+                if latest is None:
+                    break
+                if latest["version"] == current["version"]:
+                    yield ": keep-alive\n\n"
+                else:
+                    current = latest
+                    yield sse_event(current)
+        finally:
+            status_wait_slots.release()
+
+    return Response(generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/process_video", methods=["POST"])
 async def process_video(request):
@@ -194,7 +369,8 @@ async def process_video(request):
         return jsonify({"status": "error", "message": "video_path is required"}), 400
 
     try:
-        result = await main_function(video_path, request.add_bg_music)
+        from util.text_to_speech import main_function
+        result = await main_function(video_path, request.add_bg_music, request.on_progress)
         if not isinstance(result, dict):
             raise ValueError("main_function did not return a dictionary")
         return result
@@ -210,7 +386,7 @@ def download_sample_videos():
     ui_names = ["Battery", "Smoothie"]
     
     signed_urls = []
-    bucket = storage_client.bucket(bucket_name)
+    bucket = get_bucket(bucket_name)
     
     for blob_name, ui_name in zip(source_blob_names, ui_names):
         blob = bucket.blob(blob_name)
@@ -230,7 +406,7 @@ def download_sample_videos():
 @app.route("/serve_video/<video_name>", methods=["GET"])
 def serve_video(video_name: str):
     bucket_name = BUCKET_NAME
-    bucket = storage_client.bucket(bucket_name)
+    bucket = get_bucket(bucket_name)
     
     # Mapping of UI names to blob names
     video_mapping = {
@@ -255,8 +431,9 @@ def serve_video(video_name: str):
 @app.route("/download_video/<file_name>", methods=["GET"])
 def download_video(file_name: str):
     try:
-        # Retrieve the signed URL from the in-memory dictionary
-        signed_url = signed_urls.get(file_name)
+        # file_name is the output video name the job was created under
+        job = job_store.get(file_name)
+        signed_url = job["result_url"] if job else None
         if not signed_url:
             return jsonify({"detail": "File not found"}), 404
         
@@ -0,0 +1,89 @@
+import os
+import numpy as np
+import pytest
+
+from util.music_library import MusicTrack, MusicLibrary
+
+SAMPLE_RATE = 100
+
+
+def looped_stream(track, frames):
+    # The stream MusicTrack describes, built the slow way: samples[0:P], then seam + samples[fade:P] forever
+    passes = [track.samples[:track.period]]
+    while sum(len(piece) for piece in passes) < frames:
+        passes += [track.seam, track.samples[track.fade:track.period]]
+    return np.concatenate(passes)[:frames]
+
+
+@pytest.fixture
+def track():
+    samples = np.arange(1000 * 2, dtype=np.float32).reshape(1000, 2) / 2000
+    return MusicTrack("calm_1.mp3", samples, crossfade=1.0, sample_rate=SAMPLE_RATE)
+
+
+def test_excerpt_matches_the_looped_stream(track):
+    stream = looped_stream(track, 5000)
+    for start, duration in [(0, 2), (8.5, 3), (9.5, 1), (12, 4), (25.3, 13.7), (0, 50)]:
+        first = round(start * SAMPLE_RATE)
+        np.testing.assert_array_equal(track.excerpt(start, duration), stream[first:first + round(duration * SAMPLE_RATE)])
+
+
+def test_seam_crossfades_tail_into_head(track):
+    assert track.fade == SAMPLE_RATE
+    np.testing.assert_array_equal(track.seam[0], track.samples[track.period])
+    np.testing.assert_allclose(track.seam[-1], track.samples[track.period - 1 + track.fade] * 0.01 + track.samples[track.fade - 1] * 0.99, rtol=1e-6)
+
+
+def test_excerpts_that_do_not_cross_a_seam_are_views(track):
+    assert np.shares_memory(track.excerpt(1, 3), track.samples)
+    # Second pass, past the seam
+    assert np.shares_memory(track.excerpt(9 + 2, 3), track.samples)
+    assert not np.shares_memory(track.excerpt(8, 3), track.samples)
+
+
+def test_short_and_empty_excerpts():
+    track = MusicTrack("short.mp3", np.ones((3, 2), dtype=np.float32), sample_rate=SAMPLE_RATE)
+    assert track.excerpt(0, 0).shape == (0, 2)
+    assert track.excerpt(0, 0.1).shape == (10, 2)
+
+
+class FakeLibrary(MusicLibrary):
+    # Tracks of a fixed size, without GCS
+    def __init__(self, library_dir, max_bytes, frames, mmap_threshold=1 << 40):
+        super().__init__(library_dir=library_dir, mmap_threshold=mmap_threshold, max_bytes=max_bytes)
+        self.frames = frames
+        self.loads = []
+
+    def _load(self, key, bucket_name, blob_name):
+        self.loads.append(blob_name)
+        samples = np.zeros((self.frames, 2), dtype=np.float32)
+        if samples.nbytes > self.mmap_threshold:
+            path = os.path.join(self.library_dir, f"{blob_name}.f32")
+            samples.tofile(path)
+            samples = np.memmap(path, dtype=np.float32, mode="r", shape=(self.frames, 2))
+        return MusicTrack(blob_name, samples, sample_rate=SAMPLE_RATE)
+
+
+def test_least_recently_used_tracks_are_evicted(tmp_path):
+    track_bytes = 1000 * 2 * 4
+    library = FakeLibrary(str(tmp_path), max_bytes=2 * track_bytes, frames=1000)
+
+    library.get_track("bucket", "a.mp3")
+    library.get_track("bucket", "b.mp3")
+    library.get_track("bucket", "a.mp3")
+    library.get_track("bucket", "c.mp3")
+
+    assert library.is_loaded("bucket", "a.mp3") and library.is_loaded("bucket", "c.mp3")
+    assert not library.is_loaded("bucket", "b.mp3")
+    assert library.total_bytes == 2 * track_bytes
+    library.get_track("bucket", "b.mp3")
+    assert library.loads == ["a.mp3", "b.mp3", "c.mp3", "b.mp3"]
+
+
+def test_evicted_memmap_stays_readable_and_its_file_is_removed(tmp_path):
+    library = FakeLibrary(str(tmp_path), max_bytes=1, frames=1000, mmap_threshold=0)
+    first = library.get_track("bucket", "a.mp3")
+    library.get_track("bucket", "b.mp3")
+
+    assert not os.path.exists(tmp_path / "a.mp3.f32")
+    assert first.excerpt(0, 1).sum() == 0
@@ -0,0 +1,81 @@
+import os
+import pytest
+from google.api_core.exceptions import NotFound
+
+import util.tts_cache
+from util.tts_cache import TTSCache, tts_cache_key
+
+
+class FakeBlob():
+    # Like google.cloud.storage.Blob: a blob() handle knows nothing about the stored object until it is
+    # reloaded, and downloading does not fill in custom metadata
+    def __init__(self, bucket, name, metadata=None):
+        self.bucket = bucket
+        self.name = name
+        self.metadata = metadata
+
+    def download_as_bytes(self):
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        return self.bucket.objects[self.name][0]
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.objects[self.name] = (bytes(data), dict(self.metadata or {}))
+
+
+class FakeBucket():
+    def __init__(self):
+        self.objects = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        if name not in self.objects:
+            return None
+        return FakeBlob(self, name, dict(self.objects[name][1]))
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    bucket = FakeBucket()
+    monkeypatch.setattr(util.tts_cache, "get_bucket", lambda bucket_name: bucket)
+    return bucket
+
+
+def cache(directory, **kwargs):
+    return TTSCache(cache_dir=str(directory), max_bytes=1 << 20, use_gcs=True, bucket_name="bucket", **kwargs)
+
+
+def test_gcs_hit_is_served_and_copied_into_the_local_tier(tmp_path, bucket):
+    key = tts_cache_key("voice", "model", "Hello there.")
+    audio = b"ID3 fake mp3 frames"
+    cache(tmp_path / "first").put(key, audio, {"text": "Hello there.", "duration": 0.1})
+
+    # Another instance, with an empty local tier
+    second = cache(tmp_path / "second")
+    entry = second.get(key)
+
+    assert entry is not None
+    assert entry[0] == audio
+    assert entry[1] == {"text": "Hello there.", "duration": 0.1}
+    assert second._get_local(key) is not None
+
+
+def test_gcs_miss_returns_none(tmp_path, bucket):
+    assert cache(tmp_path).get(tts_cache_key("voice", "model", "Never spoken.")) is None
+
+
+def test_least_recently_used_lines_are_evicted_and_survive_a_restart(tmp_path):
+    first, second, third = (tts_cache_key("voice", "model", text) for text in ["One.", "Two.", "Three."])
+    local = TTSCache(cache_dir=str(tmp_path), max_bytes=20, use_gcs=False)
+    local.put(first, b"a" * 10, {"duration": 1})
+    local.put(second, b"b" * 10, {"duration": 1})
+    local.get(first)
+    local.put(third, b"c" * 10, {"duration": 1})
+
+    assert local.get(second) is None
+    assert not os.path.exists(tmp_path / f"{second}.mp3") and not os.path.exists(tmp_path / f"{second}.json")
+    restarted = TTSCache(cache_dir=str(tmp_path), max_bytes=20, use_gcs=False)
+    assert restarted.get(first) == (b"a" * 10, {"duration": 1})
+    assert restarted.index.total_bytes == 20
@@ -0,0 +1,110 @@
+import base64
+import hashlib
+import io
+import os
+import pytest
+
+import util.upload_stream
+from util.upload_stream import stream_multipart_upload
+
+BOUNDARY = "test-boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+class FakeWriter():
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        self.closed = True
+
+
+class TrickleStream(io.BytesIO):
+    # Hands out a few bytes per read, so parts straddle reads the way they do on a real socket
+    def read(self, size=-1):
+        return super().read(min(size, 7) if size and size > 0 else 7)
+
+
+@pytest.fixture
+def writers(monkeypatch):
+    created = []
+
+    def open_gcs_writer(bucket_name, blob_name, content_type=None):
+        writer = FakeWriter()
+        writer.target = (bucket_name, blob_name, content_type)
+        created.append(writer)
+        return writer
+
+    monkeypatch.setattr(util.upload_stream, "open_gcs_writer", open_gcs_writer)
+    return created
+
+
+def multipart_body(fields, filename, content):
+    body = bytearray()
+    for name, value in fields.items():
+        body += f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode()
+    body += (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: video/mp4\r\n\r\n"
+    ).encode() + content + b"\r\n"
+    body += f"--{BOUNDARY}--\r\n".encode()
+    return bytes(body)
+
+
+def test_file_part_is_streamed_to_gcs_and_teed_locally(tmp_path, writers):
+    content = os.urandom(200_000)
+    body = multipart_body({"add_bg_music": "true"}, "my video.mp4", content)
+
+    upload = stream_multipart_upload(TrickleStream(body), CONTENT_TYPE, "bucket", local_dir=str(tmp_path))
+
+    assert upload["filename"] == "my_video.mp4"
+    assert upload["fields"] == {"add_bg_music": "true"}
+    assert upload["size"] == len(content)
+    assert upload["md5_hash"] == base64.b64encode(hashlib.md5(content).digest()).decode()
+    assert len(writers) == 1
+    assert writers[0].target == ("bucket", "my_video.mp4", "video/mp4")
+    assert bytes(writers[0].data) == content and writers[0].closed
+    with open(upload["local_path"], "rb") as f:
+        assert f.read() == content
+
+
+def test_missing_local_dir_is_created(tmp_path, writers):
+    body = multipart_body({}, "clip.mp4", b"frames")
+
+    upload = stream_multipart_upload(io.BytesIO(body), CONTENT_TYPE, "bucket", local_dir=str(tmp_path / "temp"))
+
+    assert os.path.dirname(upload["local_path"]) == str(tmp_path / "temp")
+    assert os.path.exists(upload["local_path"])
+
+
+def test_truncated_body_removes_the_local_copy(tmp_path, writers):
+    body = multipart_body({}, "clip.mp4", os.urandom(50_000))
+
+    with pytest.raises(ValueError):
+        stream_multipart_upload(io.BytesIO(body[:30_000]), CONTENT_TYPE, "bucket", local_dir=str(tmp_path))
+
+    assert os.listdir(tmp_path) == []
+    assert not writers[0].closed
+
+
+def test_request_without_a_file_part_is_rejected(tmp_path, writers):
+    body = f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"add_bg_music\"\r\n\r\nfalse\r\n--{BOUNDARY}--\r\n".encode()
+
+    with pytest.raises(ValueError, match="No 'file' file part"):
+        stream_multipart_upload(io.BytesIO(body), CONTENT_TYPE, "bucket", local_dir=str(tmp_path))
+
+
+def test_oversized_form_field_is_rejected(tmp_path, writers):
+    body = f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"add_bg_music\"\r\n\r\n{'x' * 70_000}\r\n--{BOUNDARY}--\r\n".encode()
+
+    with pytest.raises(ValueError, match="too large"):
+        stream_multipart_upload(io.BytesIO(body), CONTENT_TYPE, "bucket", local_dir=str(tmp_path))
+
+
+def test_non_multipart_body_is_rejected(tmp_path, writers):
+    with pytest.raises(ValueError, match="multipart/form-data"):
+        stream_multipart_upload(io.BytesIO(b"{}"), "application/json", "bucket", local_dir=str(tmp_path))
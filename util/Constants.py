@@ -1,3 +1,7 @@
+import os
 
 # Upload the final video to Google Cloud Storage
-BUCKET_NAME = "viddyscribe_user_videos"
\ No newline at end of file
+BUCKET_NAME = "viddyscribe_user_videos"
+
+# "stream_copy" copies untouched GOPs and only encodes the inserts, "moviepy" re-encodes the whole video
+RENDER_MODE = os.getenv("RENDER_MODE", "stream_copy")
@@ -0,0 +1,98 @@
+import subprocess
+import wave
+import numpy as np
+
+# Every buffer in the mixer shares one layout: float32 samples shaped (frames, CHANNELS)
+SAMPLE_RATE = 44100
+CHANNELS = 2
+WAV_WRITE_CHUNK = SAMPLE_RATE * 10
+
+
+def decode_to_pcm(input_args, data=None, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    command = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        *input_args,
+        "-vn", "-f", "f32le", "-acodec", "pcm_f32le",
+        "-ac", str(channels), "-ar", str(sample_rate),
+        "-",
+    ]
+    result = subprocess.run(command, input=data, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode(errors='ignore').strip())
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels)
+
+
+def load_audio(path, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    # Decodes the whole file into memory, 8 bytes per stereo frame; meant for soundtracks and music
+    # tracks, whose size the caller accounts for
+    try:
+        return decode_to_pcm(["-i", path], sample_rate=sample_rate, channels=channels)
+    except RuntimeError as e:
+        raise RuntimeError(f"Failed to decode audio {path}: {e}")
+
+
+def decode_audio(data, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    # Encoded audio bytes (e.g. a TTS MP3 stream) in, mixer samples out, without touching the disk
+    try:
+        return decode_to_pcm(["-i", "pipe:0"], data, sample_rate, channels)
+    except RuntimeError as e:
+        raise RuntimeError(f"Failed to decode {len(data)} bytes of audio: {e}")
+
+
+def silence(duration, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    return np.zeros((round(duration * sample_rate), channels), dtype=np.float32)
+
+
+def duration_of(samples, sample_rate=SAMPLE_RATE):
+    return len(samples) / sample_rate
+
+
+def peak(samples):
+    return float(np.abs(samples).max()) if samples.size else 0.0
+
+
+def slice_seconds(samples, start, end, sample_rate=SAMPLE_RATE):
+    # Always returns round(end * sr) - round(start * sr) frames, padding with silence past the end of the track
+    start_index = max(round(start * sample_rate), 0)
+    end_index = max(round(end * sample_rate), start_index)
+    piece = samples[start_index:end_index]
+    missing = (end_index - start_index) - len(piece)
+    if missing > 0:
+        piece = np.concatenate([piece, np.zeros((missing, samples.shape[1]), dtype=np.float32)])
+    return piece
+
+
+def gain_envelope(length, gain=1.0, fade_in=0.0, fade_out=0.0, sample_rate=SAMPLE_RATE):
+    # Same linear ramps as moviepy's audio_fadein/audio_fadeout, evaluated for all frames at once
+    envelope = np.full(length, gain, dtype=np.float32)
+    if fade_in > 0:
+        envelope *= np.minimum(np.arange(length, dtype=np.float32) / (fade_in * sample_rate), 1.0)
+    if fade_out > 0:
+        envelope *= np.minimum(np.arange(length, 0, -1, dtype=np.float32) / (fade_out * sample_rate), 1.0)
+    return envelope[:, np.newaxis]
+
+
+def apply_gain(samples, gain=1.0, fade_in=0.0, fade_out=0.0, sample_rate=SAMPLE_RATE):
+    return samples * gain_envelope(len(samples), gain, fade_in, fade_out, sample_rate)
+
+
+def mix_into(buffer, samples, offset=0.0, sample_rate=SAMPLE_RATE):
+    start = max(round(offset * sample_rate), 0)
+    end = min(start + len(samples), len(buffer))
+    if end > start:
+        buffer[start:end] += samples[:end - start]
+    return buffer
+
+
+def write_wav(path, pieces, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    # The track is written piece by piece: slices of the original soundtrack are views, so joining them
+    # first would hold a second full-length copy in memory
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        for samples in pieces:
+            for start in range(0, len(samples), WAV_WRITE_CHUNK):
+                chunk = np.clip(samples[start:start + WAV_WRITE_CHUNK], -1.0, 1.0)
+                wav_file.writeframes((chunk * 32767).astype("<i2").tobytes())
+    return path
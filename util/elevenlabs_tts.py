@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+import httpx
+from elevenlabs.client import AsyncElevenLabs
+from elevenlabs.core.api_error import ApiError
+
+ELEVENLABS_MODEL_ID = "eleven_turbo_v2_5"
+# Concurrent requests across all jobs; the limit adapts between the bounds as the API allows
+TTS_CONCURRENCY_INITIAL = int(os.getenv("TTS_CONCURRENCY_INITIAL", "3"))
+TTS_CONCURRENCY_MIN = int(os.getenv("TTS_CONCURRENCY_MIN", "1"))
+TTS_CONCURRENCY_MAX = int(os.getenv("TTS_CONCURRENCY_MAX", "10"))
+TTS_MAX_ATTEMPTS = int(os.getenv("TTS_MAX_ATTEMPTS", "4"))
+TTS_CALL_TIMEOUT_SECONDS = float(os.getenv("TTS_CALL_TIMEOUT_SECONDS", "60"))
+# Pause for every request after a 429 that didn't say how long to wait
+TTS_RATE_LIMIT_COOLDOWN_SECONDS = 2.0
+
+
+class AIMDLimiter():
+    # Additive increase, multiplicative decrease: a full window of successes raises the concurrency
+    # limit by one, a rate-limit response halves it and pauses new requests for the cooldown
+    def __init__(self, initial=TTS_CONCURRENCY_INITIAL, minimum=TTS_CONCURRENCY_MIN, maximum=TTS_CONCURRENCY_MAX):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(self, throttled=False, retry_after=None):
+        async with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.limit / 2, self.minimum)
+                self.successes = 0
+                cooldown = retry_after if retry_after is not None else TTS_RATE_LIMIT_COOLDOWN_SECONDS
+                self.paused_until = max(self.paused_until, time.monotonic() + cooldown)
+                logging.warning(f"TTS rate limited, concurrency limit lowered to {int(self.limit)}")
+            else:
+                self.successes += 1
+                if self.successes >= int(self.limit) and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        # The body sets outcome["throttled"] / outcome["retry_after"] when the API pushed back
+        outcome = {"throttled": False, "retry_after": None}
+        await self.acquire()
+        try:
+            yield outcome
+        finally:
+            await self.release(outcome["throttled"], outcome["retry_after"])
+
+
+# The client's connection pool and the limiter's condition both belong to one event loop, so they are
+# shared per loop; every job on the scheduler's loop uses the same pair
+_loop_state = weakref.WeakKeyDictionary()
+_loop_state_lock = threading.Lock()
+
+
+def get_elevenlabs_state():
+    loop = asyncio.get_running_loop()
+    with _loop_state_lock:
+        if loop not in _loop_state:
+            http_client = httpx.AsyncClient(
+                timeout=TTS_CALL_TIMEOUT_SECONDS,
+                limits=httpx.Limits(max_connections=TTS_CONCURRENCY_MAX, max_keepalive_connections=TTS_CONCURRENCY_MAX),
+            )
+            client = AsyncElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"), httpx_client=http_client)
+            _loop_state[loop] = (client, AIMDLimiter())
+        return _loop_state[loop]
+
+
+def rate_limit_details(error):
+    # (throttled, retry_after_seconds) for an ElevenLabs error
+    if not isinstance(error, ApiError) or error.status_code != 429:
+        return False, None
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return True, float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return True, None
+
+
+def is_retryable(error):
+    if isinstance(error, ApiError):
+        return error.status_code is None or error.status_code == 429 or error.status_code >= 500
+    return True
+
+
+async def synthesize_elevenlabs(voice_id: str, text: str):
+    # The one retry policy for TTS: up to TTS_MAX_ATTEMPTS tries, exponential backoff with jitter,
+    # no retries for client errors other than 429
+    client, limiter = get_elevenlabs_state()
+
+    async def request():
+        audio_generator = await client.generate(
+            text=text,
+            voice=voice_id,
+            model=ELEVENLABS_MODEL_ID
+        )
+        audio = bytearray()
+        async for chunk in audio_generator:
+            audio += chunk
+        return bytes(audio)
+
+    for attempt in range(TTS_MAX_ATTEMPTS):
+        async with limiter.slot() as outcome:
+            try:
+                audio = await asyncio.wait_for(request(), TTS_CALL_TIMEOUT_SECONDS)
+                logging.info(f"Generated speech ({len(audio)} bytes) for text: '{text}'")
+                return audio
+            except Exception as e:
+                outcome["throttled"], outcome["retry_after"] = rate_limit_details(e)
+                logging.error(f"Error generating speech on attempt {attempt + 1}/{TTS_MAX_ATTEMPTS} for text: '{text}' - {e}")
+                if attempt == TTS_MAX_ATTEMPTS - 1 or not is_retryable(e):
+                    raise
+        await asyncio.sleep((2 ** attempt) + random.uniform(0, 1))
@@ -0,0 +1,192 @@
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fractions import Fraction
+from util.media_info import get_media_info, get_keyframes
+
+# Codecs we can re-encode edge pieces and still inserts for, so they concat with copied packets
+STREAM_COPY_CODECS = {"h264"}
+X264_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+}
+# Pieces encoded or copied at once; each one is its own ffmpeg process, so threads only wait on them
+RENDER_PIECE_WORKERS = int(os.getenv("RENDER_PIECE_WORKERS", "4"))
+
+
+class StreamCopyUnsupported(Exception):
+    pass
+
+
+def run_ffmpeg(args):
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"] + args
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed with code {result.returncode}: {result.stderr.strip()}")
+
+
+def check_stream_copy_supported(info):
+    if not info["has_video"]:
+        raise StreamCopyUnsupported(f"No video stream found in {info['path']}")
+    if info["codec_name"] not in STREAM_COPY_CODECS:
+        raise StreamCopyUnsupported(f"Codec {info['codec_name']} cannot be stream copied")
+    if info["rotation"]:
+        raise StreamCopyUnsupported(f"Rotated video ({info['rotation']} degrees) cannot be stream copied")
+    if info["fps"] <= 0 or (info["avg_fps"] > 0 and abs(float(info["fps"] - info["avg_fps"])) > 0.01):
+        raise StreamCopyUnsupported(f"Variable frame rate video ({info['fps']} vs {info['avg_fps']}) cannot be stream copied")
+
+
+def x264_args(info, tune=None):
+    args = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-pix_fmt", info["pix_fmt"] or "yuv420p"]
+    if tune:
+        args += ["-tune", tune]
+    profile = X264_PROFILES.get(info["profile"])
+    if profile:
+        args += ["-profile:v", profile]
+    if info["level"] and int(info["level"]) > 0:
+        args += ["-level", f"{int(info['level']) / 10:.1f}"]
+    return args + ["-an", "-f", "mpegts"]
+
+
+def copy_piece(video_path, start_frame, frame_count, info, output):
+    fps = info["fps"]
+    # Seek half a frame past the keyframe so the demuxer lands on it and not on the previous one
+    run_ffmpeg([
+        "-ss", f"{float((start_frame + Fraction(1, 2)) / fps):.6f}",
+        "-i", video_path,
+        "-map", "0:v:0",
+        "-frames:v", str(frame_count),
+        "-c:v", "copy", "-an",
+        "-bsf:v", "h264_mp4toannexb",
+        "-f", "mpegts", output,
+    ])
+
+
+def encode_piece(video_path, start_frame, frame_count, info, output):
+    fps = info["fps"]
+    # Accurate seek keeps the first frame with pts >= start, half a frame early absorbs rounding
+    run_ffmpeg([
+        "-ss", f"{float(max(start_frame - Fraction(1, 2), 0) / fps):.6f}",
+        "-i", video_path,
+        "-map", "0:v:0",
+        "-frames:v", str(frame_count),
+    ] + x264_args(info) + [output])
+
+
+def encode_still(image_path, frame_count, info, output):
+    # One looped image; after the first frame x264 only emits skip blocks, so a pause costs next to nothing
+    run_ffmpeg([
+        "-loop", "1",
+        "-framerate", str(info["fps"]),
+        "-i", image_path,
+        "-frames:v", str(frame_count),
+        "-vf", f"scale={info['width']}:{info['height']},setsar=1",
+    ] + x264_args(info, tune="stillimage") + [output])
+
+
+def plan_segment(start_frame, end_frame, keyframes):
+    # Copy whole GOPs between the first and last keyframe inside the segment, re-encode the edges
+    inner = [k for k in keyframes if start_frame <= k <= end_frame]
+    if len(inner) < 2:
+        return [("encode", start_frame, end_frame - start_frame)]
+
+    pieces = []
+    if inner[0] > start_frame:
+        pieces.append(("encode", start_frame, inner[0] - start_frame))
+    pieces.append(("copy", inner[0], inner[-1] - inner[0]))
+    if end_frame > inner[-1]:
+        pieces.append(("encode", inner[-1], end_frame - inner[-1]))
+    return pieces
+
+
+def concat_pieces(piece_paths, audio_path, output_path, work_dir):
+    list_path = os.path.join(work_dir, "concat.txt")
+    with open(list_path, "w") as f:
+        for piece_path in piece_paths:
+            f.write(f"file '{os.path.abspath(piece_path)}'\n")
+
+    run_ffmpeg([
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-i", audio_path,
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c:v", "copy",
+        "-c:a", "aac", "-b:a", "192k",
+        "-movflags", "+faststart",
+        output_path,
+    ])
+
+
+def plan_timeline(video_path, timeline, info, keyframes):
+    # Every piece of the output as (function, arguments, frame count), in timeline order. keyframes are
+    # frame numbers. Only the stills depend on their neighbours, through the frame rounding they absorb
+    fps = info["fps"]
+    pieces = []
+    output_seconds = 0
+    output_frames = 0
+    for entry in timeline:
+        if entry[0] == "segment":
+            _, start, end = entry
+            # A reversed range has no length in the soundtrack either. The part past the last frame does,
+            # but has no frames to copy, so the next still absorbs it as it does the rounding
+            if end <= start:
+                continue
+            output_seconds += end - start
+            start_frame = round(start * fps)
+            end_frame = round(min(end, info["duration"]) * fps)
+            for action, piece_start, frame_count in plan_segment(start_frame, end_frame, keyframes):
+                if frame_count <= 0:
+                    continue
+                function = copy_piece if action == "copy" else encode_piece
+                pieces.append((function, (video_path, piece_start, frame_count), frame_count))
+                output_frames += frame_count
+        else:
+            _, image_path, duration = entry
+            output_seconds += duration
+            # Stills absorb the frame rounding of the neighbouring cuts so audio and video stay aligned
+            frame_count = max(round(output_seconds * fps) - output_frames, 1)
+            pieces.append((encode_still, (image_path, frame_count), frame_count))
+            output_frames += frame_count
+    return pieces
+
+
+# timeline entries are ("segment", start_seconds, end_seconds) or ("still", image_path, duration_seconds),
+# audio_path is the finished soundtrack for the whole output; on_progress is called with the fraction
+# of output frames written so far
+def render_stream_copy(video_path, timeline, audio_path, output_path, work_dir, on_progress=None):
+    info = get_media_info(video_path)
+    check_stream_copy_supported(info)
+    fps = info["fps"]
+    keyframes = sorted({round(keyframe * fps) for keyframe in get_keyframes(video_path)})
+    logging.info(f"Stream copy render: {info['codec_name']} {info['width']}x{info['height']} @ {float(fps):.3f} fps, {len(keyframes)} keyframes")
+
+    os.makedirs(work_dir, exist_ok=True)
+    pieces = plan_timeline(video_path, timeline, info, keyframes)
+    if not pieces:
+        raise ValueError("Nothing to render: the timeline is empty")
+    output_frames = sum(frame_count for _, _, frame_count in pieces)
+
+    # Pieces are independent files, so they are produced in parallel and joined in timeline order
+    piece_paths = [os.path.join(work_dir, f"piece_{i:04d}.ts") for i in range(len(pieces))]
+    written_frames = 0
+    with ThreadPoolExecutor(max_workers=min(RENDER_PIECE_WORKERS, len(pieces)), thread_name_prefix="render-piece") as executor:
+        futures = {
+            executor.submit(function, *args, info, piece_path): frame_count
+            for (function, args, frame_count), piece_path in zip(pieces, piece_paths)
+        }
+        try:
+            for future in as_completed(futures):
+                future.result()
+                written_frames += futures[future]
+                if on_progress:
+                    on_progress(min(written_frames / output_frames, 1.0))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    concat_pieces(piece_paths, audio_path, output_path, work_dir)
+    copied_frames = sum(frame_count for function, _, frame_count in pieces if function is copy_piece)
+    logging.info(f"Stream copy render finished: {copied_frames} frames copied, {output_frames - copied_frames} frames encoded")
@@ -0,0 +1,59 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from util.ffmpeg_render import run_ffmpeg
+from util.media_info import get_media_info
+
+# ffmpeg seeks running at once per job; each one decodes a single GOP, so they are short and mostly I/O
+FRAME_GRAB_WORKERS = int(os.getenv("FRAME_GRAB_WORKERS", "4"))
+# mjpeg quality scale, 2 is visually lossless and a fraction of the size of a PNG
+FRAME_GRAB_JPEG_QUALITY = 2
+
+
+class StillFrame():
+    # A grabbed frame on disk. Only the path travels through the pipeline, the pixels are never held in memory
+    def __init__(self, path, seconds):
+        self.path = path
+        self.seconds = seconds
+
+    def __repr__(self):
+        return f"StillFrame({self.path!r}, {self.seconds:.3f})"
+
+
+def grab_frame(video_path, seconds, output):
+    # -ss before -i jumps to the keyframe before the timestamp and decodes only up to it
+    run_ffmpeg([
+        "-ss", f"{seconds:.6f}",
+        "-i", video_path,
+        "-map", "0:v:0",
+        "-frames:v", "1",
+        "-q:v", str(FRAME_GRAB_JPEG_QUALITY),
+        output,
+    ])
+    if not os.path.exists(output):
+        raise RuntimeError(f"ffmpeg wrote no frame at {seconds:.3f} seconds of {video_path}")
+
+
+def grab_frames(video_path, timestamps, output_dir, workers=FRAME_GRAB_WORKERS):
+    # One StillFrame per timestamp (in seconds), in the order given. Seeks run in parallel in
+    # timestamp order, and timestamps that land on the same frame are grabbed once
+    info = get_media_info(video_path)
+    if not info["has_video"]:
+        raise ValueError(f"No video stream found in {video_path}")
+    # A seek at or past the end produces no frame, so late timestamps fall back to the last one
+    frame_seconds = float(1 / info["fps"]) if info.get("fps") else 0.04
+    last_frame = max(info["duration"] - frame_seconds, 0)
+    frame_numbers = [round(min(max(t, 0), last_frame) / frame_seconds) for t in timestamps]
+
+    os.makedirs(output_dir, exist_ok=True)
+    stills = {}
+    for frame_number in sorted(set(frame_numbers)):
+        path = os.path.join(output_dir, f"still_{frame_number:07d}.jpg")
+        stills[frame_number] = StillFrame(path, frame_number * frame_seconds)
+
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(stills)), 1), thread_name_prefix="frame-grab") as executor:
+        futures = [executor.submit(grab_frame, video_path, still.seconds, still.path) for still in stills.values()]
+        for future in futures:
+            future.result()
+    logging.info(f"Grabbed {len(stills)} still frames for {len(timestamps)} timestamps from {video_path}")
+    return [stills[frame_number] for frame_number in frame_numbers]
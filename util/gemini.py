@@ -3,7 +3,7 @@ import json
 import subprocess
 import time
 import base64
-from moviepy.editor import VideoFileClip
+from util.media_info import get_media_info
 import warnings
 import vertexai
 from vertexai.generative_models import GenerativeModel, Part
@@ -11,22 +11,76 @@ import vertexai.preview.generative_models as generative_models
 from google.oauth2 import service_account
 import google.auth.transport.requests
 import random
+import asyncio
+import threading
+import weakref
+from util.result_cache import cached_result_async, result_cache_key, file_sha256, text_sha256
 
 
 # Suppress specific warnings
 warnings.filterwarnings("ignore", category=UserWarning, module="moviepy")
 
+PRO_MODEL_NAME = "gemini-1.5-pro-002"
+FLASH_MODEL_NAME = "gemini-1.5-flash-002"
+# Videos already in GCS are passed by gs:// reference, only files up to this size are sent inline
+GEMINI_INLINE_VIDEO_MAX_BYTES = int(os.getenv("GEMINI_INLINE_VIDEO_MAX_BYTES", str(7 * 1024 * 1024)))
+
+GENERATION_CONFIG = {
+    "max_output_tokens": 8192,
+    "temperature": 0.7,
+    "top_p": 0.95,
+}
+
+SAFETY_SETTINGS = {
+    generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
+    generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
+}
+
+GEMINI_MAX_RETRIES = 3
+GEMINI_CALL_TIMEOUT_SECONDS = float(os.getenv("GEMINI_CALL_TIMEOUT_SECONDS", "300"))
+
+async def retry_async(call, label, max_retries=GEMINI_MAX_RETRIES, timeout=GEMINI_CALL_TIMEOUT_SECONDS):
+    # call is a coroutine factory so every attempt gets a fresh request; CancelledError is not an
+    # Exception, so a cancelled job stops here instead of being retried
+    for attempt in range(max_retries):
+        try:
+            return await asyncio.wait_for(call(), timeout)
+        except Exception as e:
+            print(f"Error in {label} (Attempt {attempt + 1}/{max_retries}): {str(e) or type(e).__name__}")
+            if attempt < max_retries - 1:
+                wait_time = (2 ** attempt) + random.uniform(0, 1)  # Exponential backoff with jitter
+                print(f"Retrying in {wait_time:.2f} seconds...")
+                await asyncio.sleep(wait_time)
+            else:
+                raise
+
+def is_successful_result(result):
+    return not result["description"].startswith("Error: Failed after")
+
+def video_analysis_prompt(inst):
+    return f"""You are a video analysis AI capable of processing and analyzing video content. 
+        A video has been provided to you. Please analyze it and respond to the following instruction: 
+        {inst}
+        If you can see and analyze the video, please provide your analysis. 
+        If you cannot see or process the video for any reason, please respond with 'ERROR: Unable to process video'."""
+
 class VertexAIUtility():
     def __init__(self):
         vertexai.init(project="viddyscribe", location="us-east4")
         #vertexai.init(project="planar-abbey-418313", location="us-central1")  # Initialize here
-        self.proModel = GenerativeModel(
-            "gemini-1.5-pro-002",
-        )
-        self.flashModel = GenerativeModel(
-            "gemini-1.5-flash-002",
-        )
-        pass
+        # A model's async gRPC client is bound to the event loop it first ran on, so every loop gets
+        # its own model handles
+        self._loop_models = weakref.WeakKeyDictionary()
+        self._loop_models_lock = threading.Lock()
+
+    def loop_models(self):
+        loop = asyncio.get_running_loop()
+        with self._loop_models_lock:
+            if loop not in self._loop_models:
+                self._loop_models[loop] = (GenerativeModel(PRO_MODEL_NAME), GenerativeModel(FLASH_MODEL_NAME))
+            return self._loop_models[loop]
 
     def get_access_token(self):
         credentials = service_account.Credentials.from_service_account_file(
@@ -37,8 +91,14 @@ class VertexAIUtility():
         credentials.refresh(request)
         return credentials.token
 
-    def load_video(self, file_path):
+    def use_video_uri(self, file_path, gcs_uri):
+        return bool(gcs_uri) and os.path.getsize(file_path) > GEMINI_INLINE_VIDEO_MAX_BYTES
+
+    def load_video(self, file_path, gcs_uri=None):
         #vertexai.init(project="planar-abbey-418313", location="us-central1")  # Initialize here
+        if self.use_video_uri(file_path, gcs_uri):
+            # Vertex reads the object itself, no request carries the video bytes
+            return Part.from_uri(uri=gcs_uri, mime_type="video/mp4")
         # Load the video file synchronously
         with open(file_path, "rb") as f:
             video_data = f.read()
@@ -58,10 +118,8 @@ class VertexAIUtility():
     def validate_video(self, file_path):
         #vertexai.init(project="planar-abbey-418313", location="us-central1")  # Initialize here
         try:
-            clip = VideoFileClip(file_path)
-            duration = clip.duration
-            clip.close()
-            return duration > 0
+            info = get_media_info(file_path)
+            return info["has_video"] and info["duration"] > 0
         except Exception as e:
             print(f"Error loading video: {e}")
             return False
@@ -103,111 +161,100 @@ class VertexAIUtility():
     #     return {"description": result}
 
 
-    def get_info_from_video(self, video_path, inst):
-        video1 = self.load_video(video_path)
-        generation_config = {
-            "max_output_tokens": 8192,
-            "temperature": 0.7,
-            "top_p": 0.95,
-        }
-        safety_settings = {
-            generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        }
-
-        updated_inst = f"""You are a video analysis AI capable of processing and analyzing video content. 
-        A video has been provided to you. Please analyze it and respond to the following instruction: 
-        {inst}
-        If you can see and analyze the video, please provide your analysis. 
-        If you cannot see or process the video for any reason, please respond with 'ERROR: Unable to process video'."""
-
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                start_time = time.time()
+    async def analyze_video(self, video_path, instructions, reformat=None, gcs_uri=None):
+        # instructions maps a name to a video instruction; all of them run concurrently against one
+        # loaded Part, and a name listed in reformat gets its gemini_llm pass as soon as its own result is in
+        reformat = reformat or {}
+        loaded = {}
+
+        async def load_once():
+            if "part" not in loaded:
+                loaded["part"] = asyncio.ensure_future(asyncio.to_thread(self.load_video, video_path, gcs_uri))
+            return await loaded["part"]
+
+        async def run(name, inst):
+            result = await self.get_info_from_video_async(video_path, inst, load_once, gcs_uri)
+            if name in reformat:
+                result = await self.gemini_llm_async(result["description"], reformat[name])
+            return name, result
+
+        start_time = time.time()
+        results = dict(await asyncio.gather(*(run(name, inst) for name, inst in instructions.items())))
+        print(f"Time taken for video analysis ({', '.join(instructions)}): {time.time() - start_time} seconds")
+        return results
+
+    async def _stream_text(self, model, contents):
+        responses = await model.generate_content_async(
+            contents,
+            generation_config=GENERATION_CONFIG,
+            safety_settings=SAFETY_SETTINGS,
+            stream=True,
+        )
+        result = ""
+        async for response in responses:
+            result += response.text
+        return result
 
-                responses = self.proModel.generate_content(
-                    [video1, updated_inst],
-                    generation_config=generation_config,
-                    safety_settings=safety_settings,
-                    stream=True,
-                )
+    async def get_info_from_video_async(self, video_path, inst, load_video=None, gcs_uri=None):
+        # Same video bytes, model, prompt and config give the same analysis, so re-submissions skip the call.
+        # Waiting on Gemini doesn't hold a thread, so one event loop can carry the model calls of many jobs
+        updated_inst = video_analysis_prompt(inst)
+        video_hash = await asyncio.to_thread(file_sha256, video_path)
+        key = result_cache_key("video", video_hash, PRO_MODEL_NAME, text_sha256(updated_inst), GENERATION_CONFIG)
 
-                result = ""
-                for response in responses:
-                    result += response.text
+        async def compute():
+            video1 = await load_video() if load_video else await asyncio.to_thread(self.load_video, video_path, gcs_uri)
 
+            async def attempt():
+                result = await self._stream_text(self.loop_models()[0], [video1, updated_inst])
                 if "ERROR: Unable to process video" in result:
                     raise Exception("Gemini was unable to process the video")
+                return result
 
-                end_time = time.time()
-                time_taken = end_time - start_time
-                print(f"Time taken for response: {time_taken} seconds")
-                print({"Gemini response": result})
-
-                return {"description": result}
-
+            start_time = time.time()
+            try:
+                result = await retry_async(attempt, "video analysis")
             except Exception as e:
-                print(f"Error in video analysis (Attempt {attempt + 1}/{max_retries}): {str(e)}")
-                if attempt < max_retries - 1:
-                    wait_time = (2 ** attempt) + random.uniform(0, 1)  # Exponential backoff with jitter
-                    print(f"Retrying in {wait_time:.2f} seconds...")
-                    time.sleep(wait_time)
-                else:
-                    return {"description": f"Error: Failed after {max_retries} attempts. Last error: {str(e)}"}
+                return {"description": f"Error: Failed after {GEMINI_MAX_RETRIES} attempts. Last error: {str(e)}"}
+            print(f"Time taken for response: {time.time() - start_time} seconds")
+            print({"Gemini response": result})
+            return {"description": result}
 
+        return await cached_result_async(key, compute, is_cacheable=is_successful_result)
 
-    def gemini_llm(self, prompt, inst):
-        generation_config = {
-            "max_output_tokens": 8192,
-            "temperature": 0.7,
-            "top_p": 0.95,
-        }
-        safety_settings = {
-            generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_ONLY_HIGH,
-        }
-
-        start_time = time.time()  # Start time measurement
+    async def gemini_llm_async(self, prompt, inst):
+        key = result_cache_key("text", text_sha256(prompt), FLASH_MODEL_NAME, text_sha256(inst), GENERATION_CONFIG)
 
-        # Generate content and handle the generator
-        responses = self.flashModel.generate_content(
-            [inst + prompt],
-            generation_config=generation_config,
-            safety_settings=safety_settings,
-            stream=True,
-        )
+        async def compute():
+            start_time = time.time()
+            result = await retry_async(lambda: self._stream_text(self.loop_models()[1], [inst + prompt]), "text generation")
+            print(f"Time taken for response: {time.time() - start_time} seconds")
+            print({"Gemini response": result})
+            return {"description": result}
 
-        result = ""
-        for response in responses:
-            result += response.text
+        return await cached_result_async(key, compute)
 
-        end_time = time.time()  # End time measurement
-        time_taken = end_time - start_time  # Calculate time taken
-        print(f"Time taken for response: {time_taken} seconds")  # Print time taken
-        print({"Gemini response": result})
+    def get_info_from_video(self, video_path, inst, gcs_uri=None):
+        # Blocking entry point for scripts; jobs await get_info_from_video_async on their own loop
+        return asyncio.run(self.get_info_from_video_async(video_path, inst, gcs_uri=gcs_uri))
 
-        return {"description": result}
+    def gemini_llm(self, prompt, inst):
+        return asyncio.run(self.gemini_llm_async(prompt, inst))
     
-    def get_info_from_video_curl(self, file_path, inst):
-        # Get the base64 encoded video data
-        encoded_video_data = self.load_video_b64(file_path)  # Use load_video_b64 to get base64 encoded data
+    def get_info_from_video_curl(self, file_path, inst, gcs_uri=None):
+        if self.use_video_uri(file_path, gcs_uri):
+            video_part = {"fileData": {"mimeType": "video/mp4", "fileUri": gcs_uri}}
+        else:
+            # Get the base64 encoded video data
+            encoded_video_data = self.load_video_b64(file_path)  # Use load_video_b64 to get base64 encoded data
+            video_part = {"inlineData": {"mimeType": "video/mp4", "data": encoded_video_data}}
         # Prepare the JSON payload
         payload = {
             "contents": [
                 {
                     "role": "user",
                     "parts": [
-                        {
-                            "inlineData": {
-                                "mimeType": "video/mp4",
-                                "data": encoded_video_data  # Use the base64 encoded video data
-                            }
-                        },
+                        video_part,
                         {
                             "text": f"{inst}. Here is the video."
                         }
@@ -216,10 +263,6 @@ class VertexAIUtility():
             ]
         }
 
-        # Write the payload to a JSON file
-        with open('request.json', 'w') as json_file:
-            json.dump(payload, json_file)
-
         # Obtain the access token using the service account key file
         access_token = self.get_access_token()
 
@@ -230,13 +273,13 @@ class VertexAIUtility():
             "-H", f"Authorization: Bearer {access_token}",  # Use the access token
             "-H", "Content-Type: application/json",
             "https://us-central1-aiplatform.googleapis.com/v1/projects/viddyscribe/locations/us-east4/publishers/google/models/gemini-1.5-pro-001:streamGenerateContent",
-            "-d", "@request.json"  # Use the JSON file as the data source
+            "-d", "@-"  # Read the payload from stdin instead of a request.json on disk
         ]
 
         start_time = time.time()  # Start time measurement
 
         # Execute the curl command
-        result = subprocess.run(curl_command, capture_output=True, text=True)
+        result = subprocess.run(curl_command, input=json.dumps(payload), capture_output=True, text=True)
         response = result.stdout
 
         end_time = time.time()  # End time measurement
@@ -282,6 +325,18 @@ class VertexAIUtility():
 
         return {"description": response}
 
+_vertex_utility = None
+_vertex_utility_lock = threading.Lock()
+
+def get_vertex_utility():
+    # vertexai.init and the model handles are set up once per process and shared by every job
+    global _vertex_utility
+    if _vertex_utility is None:
+        with _vertex_utility_lock:
+            if _vertex_utility is None:
+                _vertex_utility = VertexAIUtility()
+    return _vertex_utility
+
 # Add a main function to test the get_info_from_video function
 if __name__ == "__main__":
     from llm_instructions import instructions
@@ -290,4 +345,4 @@ if __name__ == "__main__":
     inst = instructions  # Replace with your instruction
 
     # Run the function synchronously
-    VertexAIUtility().get_info_from_video(file_path, inst)
\ No newline at end of file
+    get_vertex_utility().get_info_from_video(file_path, inst)
\ No newline at end of file
@@ -0,0 +1,95 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+from urllib.parse import unquote
+from util.gcs_bucket import get_bucket, download_blob_to_file
+from util.lru_index import LRUIndex, remove_files
+from util.memory_budget import memory_budget
+
+# Lives next to the job files so entries can be hard linked into a job instead of copied
+INPUT_CACHE_DIR = os.getenv("INPUT_CACHE_DIR", "temp/input_cache")
+# On Cloud Run the filesystem is memory, so this is also a memory budget: an eighth of the instance's
+INPUT_CACHE_MAX_BYTES = int(os.getenv("INPUT_CACHE_MAX_BYTES", str(memory_budget(1 / 8))))
+
+
+def input_cache_key(bucket_name, blob_name, md5_hash=None, generation=None):
+    # Content-addressed when GCS reports an MD5; composite objects have none, so fall back to generation
+    version = f"md5:{md5_hash}" if md5_hash else f"generation:{generation}"
+    return hashlib.sha256(f"{bucket_name}/{blob_name}#{version}".encode()).hexdigest()
+
+
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+    return destination
+
+
+class InputCache():
+    def __init__(self, cache_dir=INPUT_CACHE_DIR, max_bytes=INPUT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.index = LRUIndex("input cache", max_bytes, lambda key: remove_files(self._path(key)))
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index.scan(cache_dir)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key, destination):
+        with self.lock:
+            if key not in self.index or not os.path.exists(self._path(key)):
+                self.index.discard(key)
+                return None
+            self.index.touch(key)
+            # Linking under the lock keeps eviction from deleting the file in between
+            return link_or_copy(self._path(key), destination)
+
+    def add(self, key, source_path, move=False):
+        incoming = os.path.join(self.cache_dir, f".{uuid.uuid4()}")
+        if move:
+            shutil.move(source_path, incoming)
+        else:
+            link_or_copy(source_path, incoming)
+        with self.lock:
+            os.replace(incoming, self._path(key))
+            self.index.track(key, os.path.getsize(self._path(key)))
+            self.index.evict()
+        return self._path(key)
+
+
+_input_cache = None
+_input_cache_lock = threading.Lock()
+
+
+def get_input_cache():
+    global _input_cache
+    if _input_cache is None:
+        with _input_cache_lock:
+            if _input_cache is None:
+                _input_cache = InputCache()
+    return _input_cache
+
+
+def fetch_input_video(bucket_name, blob_name, destination):
+    blob_name = unquote(blob_name)
+    # Only object metadata is fetched up front, the media itself only on a cache miss
+    blob = get_bucket(bucket_name).get_blob(blob_name)
+    if blob is None:
+        raise Exception(f"Failed to download {blob_name} from bucket {bucket_name}: blob not found")
+
+    cache = get_input_cache()
+    key = input_cache_key(bucket_name, blob_name, blob.md5_hash, blob.generation)
+    if cache.get(key, destination):
+        logging.info(f"Input cache hit for {bucket_name}/{blob_name}, skipping download")
+        return destination
+
+    download_blob_to_file(blob, destination)
+    if os.path.getsize(destination) == 0:
+        raise Exception(f"Failed to download {blob_name} from bucket {bucket_name}")
+    cache.add(key, destination)
+    return destination
@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+
+# Jobs processed at the same time; every other admitted job waits in the queue
+JOB_SLOTS_ACTIVE = int(os.getenv("JOB_SLOTS_ACTIVE", "2"))
+# Gemini / ElevenLabs stages running at once, they mostly wait on the network
+JOB_SLOTS_MODEL = int(os.getenv("JOB_SLOTS_MODEL", "4"))
+# Mixing and ffmpeg rendering at once, they hold the CPU and most of the memory of a job
+JOB_SLOTS_RENDER = int(os.getenv("JOB_SLOTS_RENDER", "1"))
+# Jobs allowed to wait for an active slot before new ones are turned away
+JOB_QUEUE_MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "10"))
+# Threads for the blocking parts of jobs (downloads, ffmpeg, NumPy), run via asyncio.to_thread
+JOB_BLOCKING_WORKERS = int(os.getenv("JOB_BLOCKING_WORKERS", "8"))
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class PrioritySlots():
+    # Like an asyncio.Semaphore, but waiters are served by priority (lower first), then in arrival order.
+    # Only used from the scheduler's event loop
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.waiters = []
+        self.counter = itertools.count()
+
+    @property
+    def waiting(self):
+        return sum(1 for _, _, waiter in self.waiters if not waiter.done())
+
+    async def acquire(self, priority=0):
+        if self.in_use < self.limit and not self.waiting:
+            self.in_use += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # A slot handed over just before the cancellation goes on to the next waiter
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            _, _, waiter = heapq.heappop(self.waiters)
+            if not waiter.done():
+                # The slot passes straight to the waiter, in_use stays the same
+                waiter.set_result(None)
+                return
+        self.in_use -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority=0):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class JobScheduler():
+    # Runs every job on one long-lived event loop in a background thread. Admission is bounded by
+    # JOB_QUEUE_MAX_DEPTH, and jobs and their heavy stages take slots per resource class
+    def __init__(self, active_slots=JOB_SLOTS_ACTIVE, model_slots=JOB_SLOTS_MODEL, render_slots=JOB_SLOTS_RENDER,
+                 max_queue_depth=JOB_QUEUE_MAX_DEPTH, blocking_workers=JOB_BLOCKING_WORKERS):
+        self.max_queue_depth = max_queue_depth
+        self.slots = {
+            "active": PrioritySlots(active_slots),
+            "model": PrioritySlots(model_slots),
+            "render": PrioritySlots(render_slots),
+        }
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=blocking_workers, thread_name_prefix="job-blocking"))
+        self.thread = threading.Thread(target=self.loop.run_forever, name="job-scheduler", daemon=True)
+        self.thread.start()
+
+    def _waiting(self):
+        # Submitted jobs only count as queued once the active slots are taken; the loop may not have
+        # started the ones it will run straight away yet. Called with the lock held
+        return max(self.queued + self.running - self.slots["active"].limit, 0)
+
+    def stats(self):
+        with self.lock:
+            return {"queue_depth": self._waiting(), "running": self.running, "max_queue_depth": self.max_queue_depth}
+
+    def submit(self, job_id, coroutine_function, *args, priority=0, on_admitted=None):
+        # Raises JobQueueFull instead of queueing without bound; returns a concurrent.futures.Future.
+        # on_admitted runs once the job has a place in the queue but before it can start, e.g. to record it
+        with self.lock:
+            waiting = self._waiting()
+            if waiting >= self.max_queue_depth:
+                raise JobQueueFull(f"{waiting} jobs are already waiting")
+            self.queued += 1
+        if on_admitted is not None:
+            try:
+                on_admitted()
+            except BaseException:
+                with self.lock:
+                    self.queued -= 1
+                raise
+        logging.info(f"Queued job {job_id} with priority {priority}")
+        return asyncio.run_coroutine_threadsafe(self._run_job(job_id, coroutine_function, args, priority), self.loop)
+
+    async def _run_job(self, job_id, coroutine_function, args, priority):
+        started = False
+        try:
+            async with self.slots["active"].slot(priority):
+                with self.lock:
+                    self.queued -= 1
+                    self.running += 1
+                started = True
+                logging.info(f"Started job {job_id}")
+                return await coroutine_function(*args)
+        finally:
+            with self.lock:
+                if started:
+                    self.running -= 1
+                else:
+                    self.queued -= 1
+
+    def slot(self, resource, priority=0):
+        return self.slots[resource].slot(priority)
+
+
+_job_scheduler = None
+_job_scheduler_lock = threading.Lock()
+
+
+def get_job_scheduler():
+    global _job_scheduler
+    if _job_scheduler is None:
+        with _job_scheduler_lock:
+            if _job_scheduler is None:
+                _job_scheduler = JobScheduler()
+    return _job_scheduler
+
+
+def resource_slot(resource, priority=0):
+    # Pipeline code takes its slots through here; outside the scheduler's loop (scripts, tests)
+    # there is nothing to share, so no limit applies
+    scheduler = _job_scheduler
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if scheduler is None or running_loop is not scheduler.loop:
+        return nullcontext()
+    return scheduler.slot(resource, priority)
@@ -0,0 +1,317 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import NotFound
+from util.Constants import BUCKET_NAME
+from util.gcs_bucket import get_bucket
+
+# "memory" (this process only), "sqlite" (every worker on one instance) or "gcs" (every instance)
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "sqlite")
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "temp/jobs.sqlite3")
+JOB_STORE_BUCKET = os.getenv("JOB_STORE_BUCKET", BUCKET_NAME)
+JOB_STORE_PREFIX = os.getenv("JOB_STORE_PREFIX", "jobs/")
+JOB_STORE_TTL_SECONDS = int(os.getenv("JOB_STORE_TTL_SECONDS", str(24 * 3600)))
+# How often a waiting status request re-reads a job that may be updated by another worker or instance
+JOB_STORE_POLL_SECONDS = float(os.getenv("JOB_STORE_POLL_SECONDS", "1"))
+# Least time between two progress writes for one job; GCS allows about one write per second per object
+JOB_UPDATE_MIN_INTERVAL_SECONDS = float(os.getenv("JOB_UPDATE_MIN_INTERVAL_SECONDS", "1"))
+# Threads writing progress updates in the background, each job uses at most one at a time
+JOB_UPDATE_WORKERS = int(os.getenv("JOB_UPDATE_WORKERS", "4"))
+# Tries for a job's final state; a job left "processing" would be polled forever
+JOB_UPDATE_FINAL_ATTEMPTS = int(os.getenv("JOB_UPDATE_FINAL_ATTEMPTS", "5"))
+
+JOB_PROCESSING = "processing"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "error"
+
+
+def new_job(job_id, status, **fields):
+    now = time.time()
+    job = {
+        "job_id": job_id,
+        "state": JOB_PROCESSING,
+        "stage": "queued",
+        "progress": 0,
+        "status": status,
+        "result_url": None,
+        "output_file": None,
+        "error": None,
+        "timings": {},
+        "created_at": now,
+        "updated_at": now,
+        "stage_started_at": now,
+        "version": 1,
+    }
+    job.update(fields)
+    return job
+
+
+def apply_update(job, fields):
+    # Leaving a stage records how long it took, so timings fill in as the job moves along
+    now = time.time()
+    stage = fields.get("stage")
+    if stage and stage != job["stage"]:
+        job["timings"][job["stage"]] = round(now - job["stage_started_at"], 3)
+        job["stage_started_at"] = now
+    job.update(fields)
+    job["updated_at"] = now
+    job["version"] += 1
+    return job
+
+
+class JobStore(ABC):
+    # Backends only read and write whole records by job id; creating and updating jobs is shared
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Condition()
+
+    @abstractmethod
+    def _read(self, job_id):
+        pass
+
+    @abstractmethod
+    def _write(self, job):
+        pass
+
+    def get(self, job_id):
+        return self._read(job_id)
+
+    def _notify(self):
+        with self.changed:
+            self.changed.notify_all()
+
+    def wait_for_change(self, job_id, version, timeout):
+        # Returns as soon as the job's version differs from the given one, or the unchanged job on timeout.
+        # Updates made in this process wake waiters at once, others are picked up on the next poll
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["version"] != version or remaining <= 0:
+                return job
+            with self.changed:
+                self.changed.wait(min(remaining, JOB_STORE_POLL_SECONDS))
+
+    def create(self, job_id, status, **fields):
+        job = new_job(job_id, status, **fields)
+        with self.lock:
+            self._write(job)
+        self._notify()
+        return job
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            job = self._read(job_id)
+            if job is None:
+                logging.warning(f"Update for unknown job {job_id}: {fields}")
+                return None
+            job = apply_update(job, fields)
+            self._write(job)
+        self._notify()
+        return job
+
+
+class InMemoryJobStore(JobStore):
+    def __init__(self, ttl_seconds=JOB_STORE_TTL_SECONDS):
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+        self.jobs = {}
+
+    def _read(self, job_id):
+        job = self.jobs.get(job_id)
+        # Copies, so callers never see a record change underneath them
+        return json.loads(json.dumps(job)) if job is not None else None
+
+    def _write(self, job):
+        self.jobs[job["job_id"]] = json.loads(json.dumps(job))
+        expired = [job_id for job_id, entry in self.jobs.items() if job["updated_at"] - entry["updated_at"] > self.ttl_seconds]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+class SQLiteJobStore(JobStore):
+    def __init__(self, path=JOB_STORE_PATH, ttl_seconds=JOB_STORE_TTL_SECONDS):
+        super().__init__()
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Autocommit mode, transactions are opened explicitly so they can take the write lock up front
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _read(self, job_id):
+        row = self.connection.execute("SELECT value FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, job):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, value, updated_at) VALUES (?, ?, ?)",
+            (job["job_id"], json.dumps(job), job["updated_at"]),
+        )
+
+    def get(self, job_id):
+        with self.lock:
+            return self._read(job_id)
+
+    def create(self, job_id, status, **fields):
+        job = new_job(job_id, status, **fields)
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._write(job)
+                self.connection.execute("DELETE FROM jobs WHERE updated_at < ?", (job["updated_at"] - self.ttl_seconds,))
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        self._notify()
+        return job
+
+    def update(self, job_id, **fields):
+        # BEGIN IMMEDIATE makes the read-modify-write atomic across gunicorn workers sharing the file
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                job = self._read(job_id)
+                if job is not None:
+                    job = apply_update(job, fields)
+                    self._write(job)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        if job is None:
+            logging.warning(f"Update for unknown job {job_id}: {fields}")
+            return None
+        self._notify()
+        return job
+
+
+class GCSJobStore(JobStore):
+    # One object per job; only the instance running a job writes it, so plain overwrites are safe.
+    # Old records are removed by the bucket's lifecycle rules
+    def __init__(self, bucket_name=JOB_STORE_BUCKET, prefix=JOB_STORE_PREFIX):
+        super().__init__()
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def _blob(self, job_id):
+        return get_bucket(self.bucket_name).blob(f"{self.prefix}{job_id}.json")
+
+    def _read(self, job_id):
+        try:
+            return json.loads(self._blob(job_id).download_as_bytes())
+        except NotFound:
+            return None
+
+    def _write(self, job):
+        blob = self._blob(job["job_id"])
+        blob.cache_control = "no-store"
+        blob.upload_from_string(json.dumps(job), content_type="application/json")
+
+
+class JobUpdates():
+    # Progress reporting for one running job. report() never blocks, so it is safe on the scheduler's
+    # event loop: updates are written by a background thread, at most one every min_interval seconds.
+    # Updates within the same stage are merged, a stage change starts a new write so timings stay exact
+    def __init__(self, store, job_id, min_interval=JOB_UPDATE_MIN_INTERVAL_SECONDS):
+        self.store = store
+        self.job_id = job_id
+        self.min_interval = min_interval
+        self.pending = []
+        self.writing = False
+        self.finished = False
+        self.last_write = 0.0
+        self.idle = threading.Condition()
+
+    def report(self, **fields):
+        with self.idle:
+            if self.finished:
+                return
+            if self.pending and fields.get("stage", self.pending[-1].get("stage")) == self.pending[-1].get("stage"):
+                self.pending[-1].update(fields)
+            else:
+                self.pending.append(dict(fields))
+            if self.writing:
+                return
+            self.writing = True
+        get_update_executor().submit(self._write_pending)
+
+    def _write_pending(self):
+        while True:
+            delay = self.last_write + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self.idle:
+                if not self.pending:
+                    self.writing = False
+                    self.idle.notify_all()
+                    return
+                fields = self.pending.pop(0)
+            try:
+                self.store.update(self.job_id, **fields)
+            except Exception as e:
+                logging.warning(f"Progress update for job {self.job_id} failed: {e}")
+            self.last_write = time.monotonic()
+
+    def finish(self, **fields):
+        # Blocking: the final state is written right away, together with any progress still pending,
+        # and retried with backoff. Later report() calls are dropped, so nothing can overwrite it
+        with self.idle:
+            self.finished = True
+            pending, self.pending = self.pending, []
+            while self.writing:
+                self.idle.wait()
+        delay = self.last_write + self.min_interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        final = {}
+        for update in pending:
+            final.update(update)
+        final.update(fields)
+        for attempt in range(JOB_UPDATE_FINAL_ATTEMPTS):
+            try:
+                return self.store.update(self.job_id, **final)
+            except Exception as e:
+                logging.warning(f"Final update for job {self.job_id} failed (attempt {attempt + 1}/{JOB_UPDATE_FINAL_ATTEMPTS}): {e}")
+                if attempt == JOB_UPDATE_FINAL_ATTEMPTS - 1:
+                    raise
+                time.sleep(max(self.min_interval, 2 ** attempt) + random.uniform(0, 1))
+
+
+_job_store = None
+_job_store_lock = threading.Lock()
+_update_executor = None
+
+
+def get_job_store():
+    global _job_store
+    if _job_store is None:
+        with _job_store_lock:
+            if _job_store is None:
+                if JOB_STORE_BACKEND == "gcs":
+                    _job_store = GCSJobStore()
+                elif JOB_STORE_BACKEND == "sqlite":
+                    _job_store = SQLiteJobStore()
+                else:
+                    _job_store = InMemoryJobStore()
+                logging.info(f"Using {type(_job_store).__name__} for job status")
+    return _job_store
+
+
+def get_update_executor():
+    global _update_executor
+    if _update_executor is None:
+        with _job_store_lock:
+            if _update_executor is None:
+                _update_executor = ThreadPoolExecutor(max_workers=JOB_UPDATE_WORKERS, thread_name_prefix="job-updates")
+    return _update_executor
@@ -0,0 +1,67 @@
+import numpy as np
+from util.audio_mix import SAMPLE_RATE
+
+LOUDNESS_HOP_SECONDS = 0.05
+# Windows analysed per block while building, keeps the temporary abs/square copies small
+BUILD_BLOCK_WINDOWS = 2048
+
+
+def normalization_gain(source_peak, target_peak):
+    # Gain that brings a clip peaking at source_peak up (or down) to target_peak
+    if not source_peak:
+        return 1.0
+    return target_peak / source_peak
+
+
+class LoudnessIndex():
+    def __init__(self, samples, sample_rate=SAMPLE_RATE, hop_seconds=LOUDNESS_HOP_SECONDS):
+        self.sample_rate = sample_rate
+        self.hop = max(int(round(hop_seconds * sample_rate)), 1)
+        self.duration = len(samples) / sample_rate
+
+        window_count = -(-len(samples) // self.hop)
+        self.peaks = np.zeros(window_count, dtype=np.float32)
+        energy = np.zeros(window_count, dtype=np.float64)
+        for first_window in range(0, window_count, BUILD_BLOCK_WINDOWS):
+            last_window = min(first_window + BUILD_BLOCK_WINDOWS, window_count)
+            block = samples[first_window * self.hop:last_window * self.hop]
+            padded = np.zeros(((last_window - first_window) * self.hop, samples.shape[1]), dtype=np.float32)
+            padded[:len(block)] = block
+            windows = padded.reshape(last_window - first_window, -1)
+            self.peaks[first_window:last_window] = np.abs(windows).max(axis=1)
+            energy[first_window:last_window] = np.square(windows, dtype=np.float64).mean(axis=1)
+
+        self.rms = np.sqrt(energy).astype(np.float32)
+        # Prefix sums of window energy give O(1) RMS over any range
+        self._energy_prefix = np.concatenate([[0.0], np.cumsum(energy)])
+        # Sparse table of window peaks: level k holds the max of 2**k consecutive windows
+        self._peak_levels = [self.peaks]
+        width = 1
+        while width * 2 <= window_count:
+            previous = self._peak_levels[-1]
+            self._peak_levels.append(np.maximum(previous[:-width], previous[width:]))
+            width *= 2
+
+        self.global_peak = float(self.peaks.max()) if window_count else 0.0
+
+    def _window_range(self, start, end):
+        first = max(int((start or 0) * self.sample_rate) // self.hop, 0)
+        if end is None:
+            last = len(self.peaks)
+        else:
+            last = min(-(-int(end * self.sample_rate) // self.hop), len(self.peaks))
+        return first, last
+
+    def peak(self, start=None, end=None):
+        first, last = self._window_range(start, end)
+        if last <= first:
+            return 0.0
+        level = (last - first).bit_length() - 1
+        table = self._peak_levels[level]
+        return float(max(table[first], table[last - (1 << level)]))
+
+    def rms_level(self, start=None, end=None):
+        first, last = self._window_range(start, end)
+        if last <= first:
+            return 0.0
+        return float(np.sqrt((self._energy_prefix[last] - self._energy_prefix[first]) / (last - first)))
@@ -0,0 +1,59 @@
+import logging
+import os
+from collections import OrderedDict
+
+
+class LRUIndex():
+    # Entry sizes of an on-disk cache, least recently used first. Not thread safe, callers hold their own lock
+    def __init__(self, name, max_bytes, remove):
+        self.name = name
+        self.max_bytes = max_bytes
+        # Called with the key of each evicted entry to delete its files
+        self.remove = remove
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def track(self, key, size):
+        self.discard(key)
+        self.entries[key] = size
+        self.total_bytes += size
+
+    def touch(self, key):
+        self.entries.move_to_end(key)
+
+    def discard(self, key):
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)
+
+    def evict(self):
+        # The newest entry is kept even when it alone is over budget
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.remove(key)
+            logging.info(f"Evicted {key} ({size} bytes) from {self.name}")
+
+    def scan(self, directory, suffix="", is_complete=None):
+        # Pick up entries left by a previous worker in the same container, oldest first. Hidden names are
+        # writes in progress
+        existing = [os.path.join(directory, name) for name in os.listdir(directory)
+                    if not name.startswith(".") and name.endswith(suffix)]
+        for path in sorted(existing, key=os.path.getmtime):
+            key = os.path.basename(path)[:len(os.path.basename(path)) - len(suffix)]
+            if is_complete is None or is_complete(key):
+                self.track(key, os.path.getsize(path))
+        self.evict()
+
+
+def remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
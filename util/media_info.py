@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+
+MEDIA_INFO_CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def run_ffprobe(args):
+    command = ["ffprobe", "-v", "error", "-of", "json"] + args
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed with code {result.returncode}: {result.stderr.strip()}")
+    return json.loads(result.stdout or "{}")
+
+
+def parse_rate(value):
+    # ffprobe reports "0/0" for cover art and for some variable frame rate streams
+    try:
+        return Fraction(value or "0/1")
+    except (ValueError, ZeroDivisionError):
+        return Fraction(0)
+
+
+def _probe(path):
+    # Stream headers and container info only; the packet scan for keyframes is left to get_keyframes
+    data = run_ffprobe([
+        "-show_entries",
+        "format=duration,start_time"
+        ":stream=index,codec_type,codec_name,profile,level,width,height,pix_fmt,r_frame_rate,avg_frame_rate,duration,sample_rate,channels"
+        ":stream_tags=rotate:stream_side_data=rotation:stream_disposition=attached_pic",
+        path,
+    ])
+    streams = data.get("streams", [])
+    # Cover art is stored as a one-frame video stream, it is never the video being described
+    video = next((s for s in streams if s.get("codec_type") == "video" and not s.get("disposition", {}).get("attached_pic")), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    container = data.get("format", {})
+    start_time = float(container.get("start_time", 0) or 0)
+    duration = float(container.get("duration", 0) or 0)
+    # The video stream's own duration, when known, so nothing is cut past its last frame
+    if video is not None and video.get("duration") not in (None, "N/A") and float(video["duration"]) > 0:
+        duration = float(video["duration"])
+
+    info = {
+        "path": path,
+        "duration": duration,
+        "start_time": start_time,
+        "has_video": video is not None,
+        "has_audio": audio is not None,
+        "audio_sample_rate": int(audio["sample_rate"]) if audio and audio.get("sample_rate") else None,
+        "audio_channels": int(audio["channels"]) if audio and audio.get("channels") else None,
+        "keyframes": [],
+    }
+    if video is None:
+        return info
+
+    rotation = int(float(video.get("tags", {}).get("rotate", 0) or 0))
+    for side_data in video.get("side_data_list", []):
+        rotation = rotation or int(float(side_data.get("rotation", 0) or 0))
+
+    info.update({
+        "video_index": video.get("index"),
+        "codec_name": video.get("codec_name"),
+        "profile": video.get("profile"),
+        "level": video.get("level"),
+        "width": int(video["width"]),
+        "height": int(video["height"]),
+        "pix_fmt": video.get("pix_fmt"),
+        "fps": parse_rate(video.get("r_frame_rate")),
+        "avg_fps": parse_rate(video.get("avg_frame_rate")),
+        "rotation": rotation,
+        "keyframes": None,
+    })
+    return info
+
+
+def _probe_keyframes(path, stream_index, start_time):
+    # Reads the packet index of the video stream alone, which is far smaller than every stream's
+    data = run_ffprobe([
+        "-select_streams", str(stream_index),
+        "-show_entries", "packet=stream_index,pts_time,flags",
+        path,
+    ])
+    keyframes = set()
+    for packet in data.get("packets", []):
+        if packet.get("stream_index", stream_index) != stream_index or "K" not in packet.get("flags", ""):
+            continue
+        if packet.get("pts_time") not in (None, "N/A"):
+            keyframes.add(float(packet["pts_time"]) - start_time)
+    return sorted(keyframes)
+
+
+def get_media_info(path):
+    # Keyed by path + mtime + size, so a file rewritten in place is probed again
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    info = _probe(path)
+    logging.info(f"Probed {path}: duration={info['duration']}, has_video={info['has_video']}, has_audio={info['has_audio']}")
+
+    with _cache_lock:
+        _cache[key] = info
+        _cache.move_to_end(key)
+        while len(_cache) > MEDIA_INFO_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
+
+
+def get_keyframes(path):
+    # Keyframe times in seconds, probed on first use and cached with the rest of the media info
+    info = get_media_info(path)
+    if info["keyframes"] is None:
+        keyframes = _probe_keyframes(path, info["video_index"], info["start_time"])
+        logging.info(f"Probed {path}: {len(keyframes)} keyframes")
+        with _cache_lock:
+            info["keyframes"] = keyframes
+    return info["keyframes"]
+
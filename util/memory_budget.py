@@ -0,0 +1,39 @@
+import logging
+import os
+
+# cgroup v2, then v1; Cloud Run sets the instance's --memory limit here
+CGROUP_MEMORY_LIMIT_FILES = ["/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"]
+# Cloud Run's default instance memory, used when no limit can be read
+DEFAULT_MEMORY_LIMIT_BYTES = 512 * 1024 * 1024
+
+_memory_limit = None
+
+
+def get_memory_limit():
+    # Bytes of memory this container may use: the cgroup limit when one is set, else physical memory
+    global _memory_limit
+    if _memory_limit is None:
+        limit = None
+        for path in CGROUP_MEMORY_LIMIT_FILES:
+            try:
+                with open(path) as f:
+                    value = f.read().strip()
+            except OSError:
+                continue
+            # "max" (v2) or a page-rounded 2**63 (v1) means no limit
+            if value.isdigit() and int(value) < 2 ** 60:
+                limit = int(value)
+            break
+        if limit is None:
+            try:
+                limit = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+            except (ValueError, OSError):
+                limit = DEFAULT_MEMORY_LIMIT_BYTES
+        _memory_limit = limit
+        logging.info(f"Memory limit: {limit} bytes")
+    return _memory_limit
+
+
+def memory_budget(fraction):
+    # On Cloud Run the filesystem is memory too, so on-disk caches are sized with this as well
+    return int(get_memory_limit() * fraction)
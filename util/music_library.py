@@ -0,0 +1,235 @@
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import uuid
+from collections import OrderedDict
+import numpy as np
+from util.audio_mix import SAMPLE_RATE, CHANNELS, load_audio, duration_of
+from util.gcs_bucket import get_bucket, download_blob_to_file
+from util.memory_budget import memory_budget
+
+MUSIC_BUCKET_NAME = "viddyscribe_bg_audio_samples"
+MUSIC_LIBRARY_DIR = os.getenv("MUSIC_LIBRARY_DIR", "temp/music_library")
+# Decoded bytes the background prefetch may fill; tracks beyond it are still loaded when a job picks them
+MUSIC_PREFETCH_MAX_BYTES = int(os.getenv("MUSIC_PREFETCH_MAX_BYTES", str(memory_budget(1 / 8))))
+# Decoded bytes the library keeps in all; the least recently used tracks are dropped beyond it
+MUSIC_LIBRARY_MAX_BYTES = int(os.getenv("MUSIC_LIBRARY_MAX_BYTES", str(memory_budget(1 / 4))))
+# Track objects are named {category}_{n}.{ext}
+MUSIC_TRACK_PATTERN = re.compile(r"^(?P<category>.+)_(?P<number>\d+)\.(mp3|wav|m4a|ogg|flac)$")
+# Decoded tracks larger than this are kept in a file-backed memmap instead of the heap
+MUSIC_MMAP_THRESHOLD_BYTES = int(os.getenv("MUSIC_MMAP_THRESHOLD_BYTES", str(32 * 1024 * 1024)))
+MUSIC_CROSSFADE_SECONDS = 1.0
+
+
+class MusicTrack():
+    # A decoded track played as an endless loop. Every pass after the first starts with a seam where the
+    # track's tail fades into its head, so with P = frames - fade the stream is:
+    #   samples[0:P], then repeatedly seam[0:fade] + samples[fade:P]
+    def __init__(self, name, samples, crossfade=MUSIC_CROSSFADE_SECONDS, sample_rate=SAMPLE_RATE):
+        self.name = name
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.duration = duration_of(samples, sample_rate)
+        frames = len(samples)
+        self.fade = min(round(crossfade * sample_rate), frames // 4)
+        self.period = frames - self.fade
+        ramp = np.linspace(0.0, 1.0, self.fade, endpoint=False, dtype=np.float32)[:, np.newaxis]
+        self.seam = samples[frames - self.fade:] * (1.0 - ramp) + samples[:self.fade] * ramp
+
+    def excerpt(self, start, duration):
+        # Samples of the looped stream from start to start + duration. Ranges that don't cross a seam are
+        # returned as read-only views into the shared buffer, without copying
+        length = round(duration * self.sample_rate)
+        first = round(start * self.sample_rate)
+        if self.period <= 0 or length <= 0:
+            return np.zeros((max(length, 0), self.samples.shape[1]), dtype=np.float32)
+        if first + length <= self.period:
+            return self.samples[first:first + length]
+        if first >= self.period:
+            offset = (first - self.period) % self.period
+            if offset >= self.fade and offset + length <= self.period:
+                return self.samples[offset:offset + length]
+
+        positions = np.arange(first, first + length)
+        looped = positions >= self.period
+        offsets = np.where(looped, (positions - self.period) % self.period, positions)
+        result = self.samples[offsets]
+        in_seam = looped & (offsets < self.fade)
+        result[in_seam] = self.seam[offsets[in_seam]]
+        return result
+
+
+class MusicLibrary():
+    # Every track is downloaded and decoded once per process and shared by all jobs that use it, until
+    # it is the least recently used one when the library is over max_bytes
+    def __init__(self, library_dir=MUSIC_LIBRARY_DIR, mmap_threshold=MUSIC_MMAP_THRESHOLD_BYTES, max_bytes=MUSIC_LIBRARY_MAX_BYTES):
+        self.library_dir = library_dir
+        self.mmap_threshold = mmap_threshold
+        self.max_bytes = max_bytes
+        self.tracks = OrderedDict()
+        self.loading = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(library_dir, exist_ok=True)
+
+    def is_loaded(self, bucket_name, blob_name):
+        with self.lock:
+            return f"{bucket_name}/{blob_name}" in self.tracks
+
+    def get_track(self, bucket_name, blob_name):
+        key = f"{bucket_name}/{blob_name}"
+        with self.lock:
+            if key in self.tracks:
+                self.tracks.move_to_end(key)
+                return self.tracks[key]
+            # One lock per track, so jobs asking for the same track wait for a single download
+            track_lock = self.loading.setdefault(key, threading.Lock())
+        with track_lock:
+            with self.lock:
+                if key in self.tracks:
+                    return self.tracks[key]
+            track = self._load(key, bucket_name, blob_name)
+            with self.lock:
+                self.tracks[key] = track
+                self.total_bytes += track.samples.nbytes
+                self.loading.pop(key, None)
+                self._evict()
+        return track
+
+    def _evict(self):
+        # Jobs still mixing an evicted track keep their reference, and a memmap stays readable after its
+        # file is unlinked, so dropping a track never disturbs a running job
+        while self.total_bytes > self.max_bytes and len(self.tracks) > 1:
+            key, track = self.tracks.popitem(last=False)
+            self.total_bytes -= track.samples.nbytes
+            pcm_path = getattr(track.samples, "filename", None)
+            if pcm_path and os.path.exists(pcm_path):
+                os.remove(pcm_path)
+            logging.info(f"Evicted music track {key} ({track.samples.nbytes} bytes)")
+
+    def _load(self, key, bucket_name, blob_name):
+        name = hashlib.sha256(key.encode()).hexdigest()
+        blob = get_bucket(bucket_name).get_blob(blob_name)
+        if blob is None:
+            raise FileNotFoundError(f"Music track {key} not found")
+        encoded_path = os.path.join(self.library_dir, f".{uuid.uuid4()}{os.path.splitext(blob_name)[1]}")
+        try:
+            # Checked against the object's CRC32C, a corrupted download raises instead of being decoded
+            download_blob_to_file(blob, encoded_path)
+            samples = load_audio(encoded_path)
+        finally:
+            if os.path.exists(encoded_path):
+                os.remove(encoded_path)
+
+        if samples.nbytes > self.mmap_threshold:
+            pcm_path = os.path.join(self.library_dir, f"{name}.f32")
+            # Replaced rather than overwritten, so another worker's mapping of an older copy stays intact
+            incoming = f"{pcm_path}.{uuid.uuid4()}"
+            samples.tofile(incoming)
+            os.replace(incoming, pcm_path)
+            samples = np.memmap(pcm_path, dtype=np.float32, mode="r", shape=(len(samples), CHANNELS))
+        logging.info(f"Loaded music track {key}: {duration_of(samples):.1f} seconds, {samples.nbytes} bytes")
+        return MusicTrack(blob_name, samples)
+
+
+class MusicCatalog():
+    # Lists every track in the music bucket by category and prefetches them into the library in the
+    # background, so picking music for a job normally costs no I/O
+    def __init__(self, library, bucket_name=MUSIC_BUCKET_NAME, prefetch_max_bytes=MUSIC_PREFETCH_MAX_BYTES):
+        self.library = library
+        self.bucket_name = bucket_name
+        self.prefetch_max_bytes = prefetch_max_bytes
+        self.categories = None
+        self.lock = threading.Lock()
+        self.prefetch_thread = None
+
+    def _list(self):
+        categories = {}
+        for blob in get_bucket(self.bucket_name).list_blobs():
+            match = MUSIC_TRACK_PATTERN.match(blob.name)
+            if match:
+                categories.setdefault(match.group("category"), []).append(blob.name)
+        for names in categories.values():
+            names.sort()
+        logging.info(f"Music catalog: {sum(len(names) for names in categories.values())} tracks in {len(categories)} categories")
+        return categories
+
+    def get_categories(self):
+        if self.categories is None:
+            with self.lock:
+                if self.categories is None:
+                    self.categories = self._list()
+        return self.categories
+
+    def tracks_for(self, category):
+        try:
+            names = self.get_categories().get(category)
+        except Exception as e:
+            logging.warning(f"Listing music bucket {self.bucket_name} failed: {e}")
+            names = None
+        # Unknown categories and listing failures fall back to the first track's conventional name
+        return names or [f"{category}_1.mp3"]
+
+    def choose(self, category):
+        names = self.tracks_for(category)
+        loaded = [name for name in names if self.library.is_loaded(self.bucket_name, name)]
+        return random.choice(loaded or names)
+
+    def prefetch(self):
+        # One track per category first, so every category is covered before the budget runs out
+        categories = self.get_categories()
+        # Prefetching past the library's own budget would only evict the tracks prefetched first
+        budget = min(self.prefetch_max_bytes, self.library.max_bytes)
+        order = sorted(categories.values(), key=len)
+        rounds = max((len(names) for names in order), default=0)
+        for i in range(rounds):
+            for names in order:
+                if i >= len(names):
+                    continue
+                if self.library.total_bytes >= budget:
+                    logging.info("Music prefetch budget reached, remaining tracks load on first use")
+                    return
+                try:
+                    self.library.get_track(self.bucket_name, names[i])
+                except Exception as e:
+                    logging.warning(f"Prefetching music track {names[i]} failed: {e}")
+
+    def start_prefetch(self):
+        with self.lock:
+            if self.prefetch_thread is None:
+                self.prefetch_thread = threading.Thread(target=self._prefetch_safely, name="music-prefetch", daemon=True)
+                self.prefetch_thread.start()
+        return self.prefetch_thread
+
+    def _prefetch_safely(self):
+        try:
+            self.prefetch()
+        except Exception as e:
+            logging.error(f"Music prefetch failed: {e}")
+
+
+_music_library = None
+_music_catalog = None
+_music_library_lock = threading.Lock()
+
+
+def get_music_library():
+    global _music_library
+    if _music_library is None:
+        with _music_library_lock:
+            if _music_library is None:
+                _music_library = MusicLibrary()
+    return _music_library
+
+
+def get_music_catalog():
+    global _music_catalog
+    if _music_catalog is None:
+        library = get_music_library()
+        with _music_library_lock:
+            if _music_catalog is None:
+                _music_catalog = MusicCatalog(library)
+    return _music_catalog
@@ -0,0 +1,83 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from util.job_scheduler import resource_slot
+
+# Worker threads per executor class, so a slow stage of one kind never queues behind another kind
+PIPELINE_EXECUTOR_WORKERS = {
+    "audio": int(os.getenv("PIPELINE_AUDIO_WORKERS", "2")),
+    "frames": int(os.getenv("PIPELINE_FRAMES_WORKERS", "2")),
+    "io": int(os.getenv("PIPELINE_IO_WORKERS", "4")),
+    "render": int(os.getenv("PIPELINE_RENDER_WORKERS", "2")),
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_stage_executor(kind):
+    executor = _executors.get(kind)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(kind)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=PIPELINE_EXECUTOR_WORKERS[kind], thread_name_prefix=f"pipeline-{kind}")
+                _executors[kind] = executor
+    return executor
+
+
+class Stage():
+    def __init__(self, name, func, deps, executor, slot):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.executor = executor
+        self.slot = slot
+
+
+class Pipeline():
+    # Per-job DAG of stages. Every stage starts as soon as the stages it depends on are done, so a job
+    # takes as long as its critical path rather than the sum of its stages
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+
+    def add(self, name, func, deps=(), executor="io", slot=None):
+        # func receives the results of deps as keyword arguments. Coroutine functions run on the event
+        # loop, plain functions on the named executor; slot is a scheduler resource held while it runs
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            raise ValueError(f"Stage {name} depends on unknown stages {missing}")
+        self.stages[name] = Stage(name, func, tuple(deps), executor, slot)
+        return self
+
+    async def _run_stage(self, stage, tasks):
+        inputs = {dep: await tasks[dep] for dep in stage.deps}
+        async with resource_slot(stage.slot) if stage.slot else nullcontext():
+            start_time = time.monotonic()
+            if asyncio.iscoroutinefunction(stage.func):
+                result = await stage.func(**inputs)
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(get_stage_executor(stage.executor), functools.partial(stage.func, **inputs))
+            logging.info(f"{self.name}: stage {stage.name} took {time.monotonic() - start_time:.2f} seconds")
+        return result
+
+    async def run(self):
+        # Returns every stage's result by name; the first failure cancels the stages still running
+        tasks = {}
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.ensure_future(self._run_stage(stage, tasks))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return {name: task.result() for name, task in tasks.items()}
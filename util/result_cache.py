@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from google.api_core.exceptions import NotFound
+from util.Constants import BUCKET_NAME
+from util.gcs_bucket import get_bucket
+
+# "sqlite" (local disk), "gcs" (shared by all instances) or "none"
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "sqlite")
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "temp/result_cache.sqlite3")
+RESULT_CACHE_BUCKET = os.getenv("RESULT_CACHE_BUCKET", BUCKET_NAME)
+RESULT_CACHE_PREFIX = os.getenv("RESULT_CACHE_PREFIX", "result_cache/")
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "2000"))
+FILE_HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_sha256(path):
+    # Remembered per path + mtime + size, so the analysis calls of one job hash the video once
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _file_hashes_lock:
+        if key in _file_hashes:
+            return _file_hashes[key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(FILE_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+
+    with _file_hashes_lock:
+        if len(_file_hashes) > 256:
+            _file_hashes.clear()
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+def result_cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class NullResultCache():
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+
+class SQLiteResultCache():
+    def __init__(self, path=RESULT_CACHE_PATH, ttl_seconds=RESULT_CACHE_TTL_SECONDS, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                with self.connection:
+                    self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            with self.connection:
+                self.connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            self.connection.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,))
+            # Least recently used entries go first once the table is over its size limit
+            self.connection.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+class GCSResultCache():
+    # Size is bounded by the bucket's lifecycle rules, TTL is enforced on read
+    def __init__(self, bucket_name=RESULT_CACHE_BUCKET, prefix=RESULT_CACHE_PREFIX, ttl_seconds=RESULT_CACHE_TTL_SECONDS):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+
+    def _blob(self, key):
+        return get_bucket(self.bucket_name).blob(f"{self.prefix}{key}.json")
+
+    def get(self, key):
+        try:
+            entry = json.loads(self._blob(key).download_as_bytes())
+        except NotFound:
+            return None
+        if time.time() - entry["created_at"] > self.ttl_seconds:
+            return None
+        return entry["value"]
+
+    def set(self, key, value):
+        entry = {"created_at": time.time(), "value": value}
+        self._blob(key).upload_from_string(json.dumps(entry), content_type="application/json")
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                if RESULT_CACHE_BACKEND == "gcs":
+                    _result_cache = GCSResultCache()
+                elif RESULT_CACHE_BACKEND == "sqlite":
+                    _result_cache = SQLiteResultCache()
+                else:
+                    _result_cache = NullResultCache()
+                logging.info(f"Using {type(_result_cache).__name__} for model results")
+    return _result_cache
+
+
+def cached_result(key, compute, is_cacheable=lambda value: True):
+    cache = get_result_cache()
+    try:
+        value = cache.get(key)
+    except Exception as e:
+        logging.warning(f"Result cache read failed, calling the model: {e}")
+        value = None
+    if value is not None:
+        logging.info(f"Result cache hit for {key[:12]}")
+        return value
+
+    value = compute()
+    if is_cacheable(value):
+        try:
+            cache.set(key, value)
+        except Exception as e:
+            logging.warning(f"Result cache write failed: {e}")
+    return value
+
+
+async def cached_result_async(key, compute, is_cacheable=lambda value: True):
+    # Same as cached_result for a coroutine factory; cache I/O runs off the event loop
+    cache = get_result_cache()
+    try:
+        value = await asyncio.to_thread(cache.get, key)
+    except Exception as e:
+        logging.warning(f"Result cache read failed, calling the model: {e}")
+        value = None
+    if value is not None:
+        logging.info(f"Result cache hit for {key[:12]}")
+        return value
+
+    value = await compute()
+    if is_cacheable(value):
+        try:
+            await asyncio.to_thread(cache.set, key, value)
+        except Exception as e:
+            logging.warning(f"Result cache write failed: {e}")
+    return value
@@ -1,28 +1,33 @@
 import json
 import re
 import logging
-from asyncio import Semaphore
 import shutil
-from moviepy.editor import VideoFileClip, concatenate_videoclips, ImageClip, AudioFileClip, CompositeVideoClip, CompositeAudioClip, TextClip
+from moviepy.editor import VideoFileClip, concatenate_videoclips, ImageClip, AudioFileClip
 from google.api_core.exceptions import ResourceExhausted
 import uuid
-from util.Constants import BUCKET_NAME
+from util.Constants import BUCKET_NAME, RENDER_MODE
 from moviepy.video.io.ffmpeg_tools import ffmpeg_extract_subclip
-import azure.cognitiveservices.speech as speechsdk
 from util.bgaudio import BackgroundAudioGenerator
-from util.gcs_bucket import upload_to_gcs, download_from_gcs
+from util.gcs_bucket import upload_to_gcs
 from util.llm_instructions import insturctions_combined_format, instructions_timestamp_format, instructions_choose_category
-import datetime
 import os
+from urllib.parse import unquote
 import asyncio
-from elevenlabs.client import AsyncElevenLabs
 from elevenlabs import save
 import os
-import glob
 import asyncio
-from pydub import AudioSegment
 from dotenv import load_dotenv
-from util.gemini import VertexAIUtility
+from util.gemini import get_vertex_utility
+from util.elevenlabs_tts import synthesize_elevenlabs, ELEVENLABS_MODEL_ID
+from util.tts_cache import get_tts_cache, tts_cache_key, normalize_tts_text
+from util.ffmpeg_render import render_stream_copy, StreamCopyUnsupported
+from util.audio_mix import load_audio, decode_audio, silence, duration_of, peak, slice_seconds, apply_gain, mix_into, write_wav
+from util.loudness import LoudnessIndex, normalization_gain
+from util.media_info import get_media_info
+from util.input_cache import fetch_input_video
+from util.frame_grabber import grab_frames
+from util.job_scheduler import resource_slot
+from util.pipeline import Pipeline
 import os
 
 load_dotenv()
@@ -42,40 +47,60 @@ def get_voice_name(voice_model: str):
     else:
         raise ValueError(f"Unsupported voice model: {voice_model}")
 
-async def tts_utility(model_name, text, filename):
+async def tts_utility(model_name, text):
+    # Returns the encoded speech (MP3 for ElevenLabs) as bytes
     voice = get_voice_name(model_name)
     # if model_name == "Azure":
     #     return text_to_wav_azure(voice, text, filename)
     # elif model_name == "Google":
     #     return text_to_wav(voice, text, filename)
     if model_name == "ElevenLabs":
-        return await text_to_wav_elevenlabs(voice, text, filename)
+        return await synthesize_elevenlabs(voice, text)
 
-async def text_to_wav_elevenlabs(voice_id: str, text: str, filename: str):
-    client = AsyncElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
-    max_retries = 3
-    retry_delay = 2  # seconds
-
-    for attempt in range(max_retries):
-        try:
-            audio_generator = await client.generate(
-                text=text,
-                voice=voice_id,
-                model="eleven_turbo_v2_5"
-            )
-            with open(filename, "wb") as f:
-                async for chunk in audio_generator:
-                    f.write(chunk)
-            logging.info(f'Generated speech saved to "{filename}"')
-            return  # Exit the function if successful
-        except Exception as e:
-            logging.error(f"Error generating WAV file on attempt {attempt + 1} for text: '{text}' - {e}")
-            if attempt < max_retries - 1:
-                await asyncio.sleep(retry_delay)
-            else:
-                raise
+async def synthesize_line(model_name, text):
+    # Decoded samples for one narration line, served from the TTS cache when this voice and model
+    # have spoken the same text before
+    text = normalize_tts_text(text)
+    voice = get_voice_name(model_name)
+    key = tts_cache_key(voice, ELEVENLABS_MODEL_ID, text)
+    cache = get_tts_cache()
+    cached = await asyncio.to_thread(cache.get, key)
+    if cached is not None:
+        logging.info(f"TTS cache hit for text: '{text}'")
+        # The cache keeps the MP3, ffmpeg decodes it from a pipe, off the event loop
+        return await asyncio.to_thread(decode_audio, cached[0])
+
+    audio = await tts_utility(model_name, text)
+    samples = await asyncio.to_thread(decode_audio, audio)
+    metadata = {"voice_id": voice, "model_id": ELEVENLABS_MODEL_ID, "text": text, "duration": duration_of(samples)}
+    try:
+        await asyncio.to_thread(cache.put, key, audio, metadata)
+    except Exception as e:
+        logging.warning(f"TTS cache write failed: {e}")
+    return samples
+
+class TTSClip():
+    # One narration line of a job, decoded once and kept in memory until it is mixed
+    def __init__(self, start_timestamp, text, samples):
+        self.start_timestamp = start_timestamp
+        self.start_seconds = timestamp_seconds(start_timestamp)
+        self.text = text
+        self.samples = samples
+        self.duration = duration_of(samples)
+
+    def __repr__(self):
+        return f"TTSClip([{self.start_timestamp}] {self.duration:.3f}s {self.text!r})"
+
+def report_progress(on_progress, stage, progress, status):
+    # Progress reporting must never take a job down with it
+    if on_progress is None:
+        return
+    try:
+        on_progress(stage, progress, status)
+    except Exception as e:
+        logging.warning(f"Progress report for stage {stage} failed: {e}")
 
-async def generate_wav_files_from_response(response_body: dict, model_name: str, unique_id: str):
+async def generate_narration_clips(response_body: dict, model_name: str, on_progress=None):
     description = response_body["description"]
     logging.info(f"Description: {description}")
     pattern = re.compile(r'\[(\d{1,2}:\d{2}(?:\.\d{3})?)\] (.+)')
@@ -85,80 +110,43 @@ async def generate_wav_files_from_response(response_body: dict, model_name: str,
         logging.error("No timestamps found in the description returned by gemini.")
         raise ValueError("Failed to generate response audio timestamps")
 
-    timestamp_ranges = []
-    tasks = []
-    semaphore = Semaphore(3)
-
-    async def limited_tts_utility(model_name, text, filename):
-        async with semaphore:
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    await tts_utility(model_name, text, filename)
-                    break
-                except Exception as e:
-                    logging.error(f"Error generating WAV file on attempt {attempt + 1} for text: '{text}' - {e}")
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(2)
-                    else:
-                        raise
-
-    for match in matches:
-        timestamp, text = match
-        start_time = timestamp.strip('[')
-        filename = f"temp/{unique_id}_{start_time.replace(':', '-')}.wav"
-        logging.info(f"Generating WAV for text: '{text}' at timestamp: {start_time} with filename: {filename}")
-        tasks.append(limited_tts_utility(model_name, text, filename))
+    completed = 0
 
-    await asyncio.gather(*tasks)
+    async def narrate_line(model_name, start_time, text):
+        # Concurrency and retries are handled by the shared TTS client, across all jobs
+        nonlocal completed
+        clip = TTSClip(start_time, text, await synthesize_line(model_name, text))
+        completed += 1
+        report_progress(on_progress, "tts", 35 + 25 * completed / len(matches), f"Generating narration... {completed}/{len(matches)} clips")
+        return clip
 
-    for match in matches:
-        timestamp, text = match
+    tasks = []
+    for timestamp, text in matches:
         start_time = timestamp.strip('[')
-        filename = f"temp/{unique_id}_{start_time.replace(':', '-')}.wav"
-        logging.info(f"Generating WAV for text: '{text}' at timestamp: {start_time} with filename: {filename}")
-        
-        max_wait_time = 30
-        wait_interval = 0.5
-        elapsed_time = 0
-
-        while (not os.path.exists(filename) or os.path.getsize(filename) == 0) and elapsed_time < max_wait_time:
-            logging.info(f"Waiting for file {filename} to be created. Elapsed time: {elapsed_time}s")
-            await asyncio.sleep(wait_interval)
-            elapsed_time += wait_interval
+        logging.info(f"Generating speech for text: '{text}' at timestamp: {start_time}")
+        tasks.append(narrate_line(model_name, start_time, text))
 
-        if not os.path.exists(filename) or os.path.getsize(filename) == 0:
-            logging.error(f"Failed to generate WAV file: {filename}")
-            raise Exception(f"Failed to generate WAV file: {filename}")
+    # gather keeps the description's order
+    clips = await asyncio.gather(*tasks)
+    logging.info(f"Generated narration clips: {clips}")
+    return clips
 
-        audio_clip = AudioFileClip(filename)
-        duration = audio_clip.duration
-
-        try:
-            start_dt = datetime.datetime.strptime(start_time, "%M:%S.%f")
-        except ValueError:
-            start_dt = datetime.datetime.strptime(start_time, "%M:%S")
-
-        end_time = (start_dt + datetime.timedelta(seconds=duration)).strftime("%M-%S.%f")[:-3]
-        new_filename = f"temp/{unique_id}_{start_time.replace(':', '-')}_to_{end_time}.wav"
-        os.rename(filename, new_filename)
-        logging.info(f"Generated speech saved to \"{new_filename}\"")
-
-        timestamp_ranges.append(f"[{start_time}] - [{end_time}] {text}")
-
-    logging.info(f"Generated timestamp ranges: {timestamp_ranges}")
-    return timestamp_ranges
-
-def get_audio_desc_util(video_path, add_bg_music):
-    v = VertexAIUtility()
+async def get_audio_desc_util(video_path, add_bg_music, gcs_uri=None):
+    v = get_vertex_utility()
     
-    if not v.validate_video(video_path):
+    if not await asyncio.to_thread(v.validate_video, video_path):
         print(f"Error: Video file '{video_path}' is invalid or corrupted.")
-        return {"error": "Invalid video file"}
+        return {"error": "Invalid video file"}, None
+
+    # The category call runs alongside the description, which is reformatted as soon as it arrives
+    instructions = {"description": insturctions_combined_format}
+    if add_bg_music:
+        instructions["category"] = instructions_choose_category
+    results = await v.analyze_video(video_path, instructions, reformat={"description": instructions_timestamp_format}, gcs_uri=gcs_uri)
 
-    response_audio_desc = v.get_info_from_video(video_path, insturctions_combined_format)
+    reformmated_desc = results["description"]
     if add_bg_music:
-        bg_audio_response = v.get_info_from_video(video_path, instructions_choose_category)["description"]
+        bg_audio_response = results["category"]["description"]
         try:
             # Strip the code block markers and parse the JSON
             bg_audio_response = bg_audio_response.strip('```json').strip('```').strip()
@@ -169,77 +157,63 @@ def get_audio_desc_util(video_path, add_bg_music):
     else:
         bg_audio_category = None
 
-    reformmated_desc = v.gemini_llm(prompt=response_audio_desc["description"], inst=instructions_timestamp_format)
     return reformmated_desc, bg_audio_category
 
-def convert_mp4_to_wav(video_path):
-    logging.info(f"Converting video to audio: {video_path}")
-    audio_path = f"{os.path.splitext(video_path)[0]}.wav"
-    try:
-        # Check if the video file exists
-        if not os.path.exists(video_path):
-            raise FileNotFoundError(f"Video file not found: {video_path}")
-
-        # Get file info
-        file_size = os.path.getsize(video_path)
-        logging.info(f"Video file size: {file_size} bytes")
-
-        # Try to open the file with moviepy first
-        try:
-            video = VideoFileClip(video_path)
-            if video.audio is not None:
-                audio = video.audio
-                audio.write_audiofile(audio_path)
-                logging.info(f"Audio exported to: {audio_path} using moviepy")
-            else:
-                logging.warning(f"No audio stream found in video: {video_path}")
-                return None
-        except Exception as moviepy_error:
-            logging.warning(f"Moviepy conversion failed: {moviepy_error}. Trying pydub...")
-
-            # If moviepy fails, try pydub
-            video = AudioSegment.from_file(video_path, format="mp4")
-            video.export(audio_path, format="wav")
-            logging.info(f"Audio exported to: {audio_path} using pydub")
-
-    except FileNotFoundError as e:
-        logging.error(f"File not found error: {e}")
-        raise
-    except Exception as e:
-        logging.error(f"Error during conversion: {e}")
-        logging.error(f"Error type: {type(e).__name__}")
-        logging.error(f"Error args: {e.args}")
-        import traceback
-        logging.error(f"Traceback: {traceback.format_exc()}")
-        raise
+def extract_original_audio(video_path):
+    # One ffmpeg -vn pass decodes the soundtrack straight to float32 PCM in memory; a video without
+    # audio gets a silent track of its own length.
+    # The whole track stays resident for the job, about 21 MB per minute of video at 44.1 kHz stereo:
+    # the mixer slices it at every insert and LoudnessIndex is built over all of it. Memory-mapping a file
+    # instead would not help on Cloud Run, where the filesystem is RAM too. What keeps peak memory to
+    # one track per job is that nothing copies it: inserts are mixed into small buffers and write_wav
+    # streams the pieces out
+    logging.info(f"Extracting audio from video: {video_path}")
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video file not found: {video_path}")
+
+    media_info = get_media_info(video_path)
+    if not media_info["has_audio"]:
+        logging.warning(f"No audio found in video: {video_path}. Proceeding without original audio.")
+        original_audio = silence(media_info["duration"])
+        logging.info(f"Created blank audio track with duration: {duration_of(original_audio)}")
+        return original_audio
 
-    return audio_path
+    original_audio = load_audio(video_path)
+    logging.info(f"Loaded original audio track with duration: {duration_of(original_audio)}")
+    return original_audio
 
-async def main_function(gcs_url, add_bg_music):
+async def main_function(gcs_url, add_bg_music, on_progress=None):
+    # on_progress(stage, percent, status_message) is called as the job moves through its stages
     output_path = os.path.splitext(gcs_url)[0] + "_output.mp4"
     try:
         unique_id = uuid.uuid4()
         video_path = f"temp/temp_video_{unique_id}.mp4"
-        download_from_gcs(BUCKET_NAME, gcs_url, video_path)
+        await asyncio.to_thread(fetch_input_video, BUCKET_NAME, gcs_url, video_path)
         
-        clip = VideoFileClip(video_path)
-        video_duration = clip.duration
+        media_info = await asyncio.to_thread(get_media_info, video_path)
+        if not media_info["has_video"]:
+            raise ValueError(f"No video stream found in {video_path}")
+        video_duration = media_info["duration"]
         logging.info(f"Video loaded successfully. Duration: {video_duration} seconds")
-        clip.close()
+        report_progress(on_progress, "downloaded", 10, "Video received. Describing it with Gemini...")
     except Exception as e:
         logging.error(f"Error loading video: {e}")
         return {"status": "error", "message": str(e)}
     
-    response_audio_desc, bg_audio_category = get_audio_desc_util(video_path, add_bg_music)
+    # Gemini reads the uploaded object straight from the bucket instead of receiving it inline
+    gcs_uri = f"gs://{BUCKET_NAME}/{unquote(gcs_url)}"
+    async with resource_slot("model"):
+        response_audio_desc, bg_audio_category = await get_audio_desc_util(video_path, add_bg_music, gcs_uri)
     if "error" in response_audio_desc:
         logging.error(f"Error in Gemini response: {response_audio_desc['error']}")
         return {"status": "error", "message": response_audio_desc["error"]}
+    report_progress(on_progress, "analyzed", 35, "Video described. Generating narration...")
 
     response_body = {
         "description": response_audio_desc["description"],
     }
     try:
-        await create_final_video_v2(video_path, bg_audio_category, response_body, output_path, "ElevenLabs", unique_id, add_bg_music)
+        await create_final_video_v2(video_path, bg_audio_category, response_body, output_path, "ElevenLabs", unique_id, add_bg_music, on_progress)
     except ValueError as e:
         logging.error(f"Error during video processing: {e}")
         return {"status": "error", "message": str(e)}
@@ -247,178 +221,180 @@ async def main_function(gcs_url, add_bg_music):
         logging.error(f"Unexpected error during video processing: {e}")
         return {"status": "error", "message": str(e)}
     
-    gcs_url = upload_to_gcs(BUCKET_NAME, output_path, os.path.basename(output_path))
+    report_progress(on_progress, "uploading", 90, "Uploading the finished video...")
+    gcs_url = await asyncio.to_thread(upload_to_gcs, BUCKET_NAME, output_path, os.path.basename(output_path))
+    report_progress(on_progress, "uploaded", 95, "Video uploaded. Preparing download link...")
 
+    # Audio, narration and music never touch the disk, only the input and output videos are left
     os.remove(video_path)
     os.remove(output_path)
-    # Remove only the .wav files with the unique_id
-    wav_files = glob.glob(f'temp/{unique_id}_*.wav')
-    for wav_file in wav_files:
-        os.remove(wav_file)
-    
-    # Remove the temporary video file
-    temp_video_file = f"temp/temp_video_{unique_id}.mp4"
-    if os.path.exists(temp_video_file):
-        os.remove(temp_video_file)
-
-    # Remove the temporary video file
-    temp_generated_wav_file = f"temp/temp_video_{unique_id}.wav"
-    if os.path.exists(temp_generated_wav_file):
-        os.remove(temp_generated_wav_file)
     
     return {"status": "success", "output_url": gcs_url}
 
-async def create_final_video_v2(video_path: str, bg_audio_category: str, response_body: dict, output_path: str, model_name, unique_id: str, add_bg_music : str):
-    logging.info(f"Starting create_final_video_v2 with video_path: {video_path}, output_path: {output_path}, model_name: {model_name}")
+def render_with_moviepy(video_path, timeline, audio_path, output_path):
+    video = VideoFileClip(video_path, audio=False)
+    try:
+        clips = []
+        for entry in timeline:
+            if entry[0] == "segment":
+                _, start, end = entry
+                if end > start:
+                    clips.append(video.subclip(start, end).without_audio())
+            else:
+                _, image_path, duration = entry
+                clips.append(ImageClip(image_path).set_duration(duration))
 
-    if add_bg_music and bg_audio_category:
-        bg_audio_generator = BackgroundAudioGenerator(bg_audio_category)
-    
-    original_videos_audio = convert_mp4_to_wav(video_path)
-    if original_videos_audio is None:
-        logging.warning(f"No audio found in video: {video_path}. Proceeding without original audio.")
-        original_audio_clip = None
-    else:
-        logging.info(f"Converted video to audio: {original_videos_audio}")
-        original_audio_clip = AudioFileClip(original_videos_audio)
-        logging.info(f"Loaded original audio clip with duration: {original_audio_clip.duration}")
-
-    if original_audio_clip is None:
-        video = VideoFileClip(video_path)
-        blank_audio = AudioSegment.silent(duration=video.duration * 1000)  # duration in milliseconds
-        blank_audio_path = f"temp/{unique_id}_blank_audio.wav"
-        blank_audio.export(blank_audio_path, format="wav")
-        original_audio_clip = AudioFileClip(blank_audio_path).set_start(0)
-        logging.info(f"Created blank audio clip with duration: {original_audio_clip.duration}")
-
-
-    response_audio_timestamps = await generate_wav_files_from_response(response_body, model_name, unique_id)
-    if not response_audio_timestamps:
-        logging.error("Failed to generate response audio timestamps")
-        raise ValueError("Failed to generate response audio timestamps")
+        final_clip = concatenate_videoclips(clips).set_audio(AudioFileClip(audio_path))
+        final_clip.write_videofile(output_path, codec="libx264", audio_codec="aac")
+        return final_clip.duration
+    finally:
+        video.close()
 
-    try:
-        video = VideoFileClip(video_path)
-        logging.info(f"Loaded video file with duration: {video.duration}")
-    except OSError as e:
-        logging.error(f"Error loading video file {video_path}: {e}")
-        raise ValueError(f"Error loading video file {video_path}: {e}")
+async def create_final_video_v2(video_path: str, bg_audio_category: str, response_body: dict, output_path: str, model_name, unique_id: str, add_bg_music : str, on_progress=None):
+    logging.info(f"Starting create_final_video_v2 with video_path: {video_path}, output_path: {output_path}, model_name: {model_name}")
 
-    description = response_body["description"]
     pattern = re.compile(r'\[(\d{1,2}:\d{2}(?:\.\d{3})?)\] (.+)')
-    matches = pattern.findall(description)
+    matches = pattern.findall(response_body["description"])
     logging.info(f"Found {len(matches)} matches in the description")
-
-    clips = []
+    render_dir = f"temp/{unique_id}_render"
+    os.makedirs(render_dir, exist_ok=True)
+
+    async def narrate():
+        return await generate_narration_clips(response_body, model_name, on_progress)
+
+    def render(original_audio, loudness, stills, music, narration):
+        assemble_final_video(video_path, narration, stills, music, output_path, render_dir, original_audio, loudness, on_progress)
+
+    # Narration, the original soundtrack and the still frames only meet at render time, so they are
+    # produced side by side and the render waits for the last of them
+    pipeline = Pipeline(f"job {unique_id}")
+    pipeline.add("narration", narrate, slot="model")
+    pipeline.add("original_audio", lambda: extract_original_audio(video_path), executor="audio")
+    # Built once per job, every peak lookup in the render is answered from it instead of rescanning the track
+    pipeline.add("loudness", lambda original_audio: LoudnessIndex(original_audio), deps=["original_audio"], executor="audio")
+    pipeline.add("stills", lambda: grab_frames(video_path, [timestamp_seconds(timestamp) for timestamp, _ in matches], render_dir), executor="frames")
+    pipeline.add("music", lambda: BackgroundAudioGenerator(bg_audio_category) if add_bg_music and bg_audio_category else None, executor="io")
+    pipeline.add("render", render, deps=["original_audio", "loudness", "stills", "music", "narration"], executor="render", slot="render")
+    try:
+        await pipeline.run()
+    finally:
+        shutil.rmtree(render_dir, ignore_errors=True)
+
+def timestamp_seconds(timestamp):
+    ts_parts = timestamp.split(':')
+    return int(ts_parts[0]) * 60 + float(ts_parts[1])
+
+def assemble_final_video(video_path, narration_clips, still_frames, bg_audio_generator, output_path, render_dir, original_audio, original_loudness, on_progress=None):
+    # Mixes the soundtrack around the generated narration and renders the output video
+    original_audio_duration = duration_of(original_audio)
+    video_duration = get_media_info(video_path)["duration"]
+
+    # The video timeline and its soundtrack are built side by side, one audio piece per timeline entry
+    timeline = []
+    audio_pieces = []
     last_end = 0
-    added_timestamps = set()
 
-    for i, (start_timestamp, text) in enumerate(matches):
-        logging.info(f"Processing match {i}: start_timestamp={start_timestamp}, text={text}")
+    vid_max_volume = original_loudness.global_peak
+    fade_duration = 0.5
+    bg_fade_duration = 0.2
+
+    # Gemini's timestamps can come back out of order, repeated or past the end of the video. Inserts are
+    # placed in time order and inside the video, so no segment of the timeline runs backwards
+    inserts = sorted(zip(narration_clips, still_frames), key=lambda insert: insert[0].start_seconds)
+    for i, (clip, still_frame) in enumerate(inserts):
+        start_timestamp = clip.start_timestamp
+        logging.info(f"Processing match {i}: start_timestamp={start_timestamp}, text={clip.text}")
         
-        ts_parts = start_timestamp.split(':')
-        ts_start_seconds = int(ts_parts[0]) * 60 + float(ts_parts[1])
+        ts_start_seconds = min(max(clip.start_seconds, 0), video_duration)
         logging.info(f"Calculated start time in seconds: {ts_start_seconds}")
 
-        audio_filename = f"temp/{unique_id}_{start_timestamp.replace(':', '-')}_to_*.wav"
-        audio_files = glob.glob(audio_filename)
-        if not audio_files:
-            raise FileNotFoundError(f"Audio file matching {audio_filename} not found")
-        audio_clip = AudioFileClip(audio_files[0])
-        logging.info(f"Loaded audio clip from {audio_files[0]} with duration: {audio_clip.duration}")
-        
-        insertion_time = ts_start_seconds
-        still_frame_time = ts_start_seconds
+        desc_audio = clip.samples
+        desc_duration = clip.duration
+        logging.info(f"Using narration clip with duration: {desc_duration}")
         logging.warning(f"Inserting audio description at: {start_timestamp}")
 
-        if still_frame_time is not None:
-            if still_frame_time == insertion_time:
-                segment = video.subclip(last_end, still_frame_time)
-                clips.append(segment)
-                logging.info(f"Added video segment from {last_end} to {still_frame_time}")
-
-        if still_frame_time is not None and insertion_time == still_frame_time:
-            still_frame = video.get_frame(still_frame_time)
-            still_clip = ImageClip(still_frame).set_duration(audio_clip.duration)
-            still_clip = still_clip.set_audio(audio_clip)
-            logging.info(f"Created still clip with duration: {audio_clip.duration}")
-
-            if ts_start_seconds == 0: 
-                e_time = ts_start_seconds + 5 
-            else:
-                e_time = ts_start_seconds
-
-            fade_duration = 0.5
-            bg_fade_duration = 0.2
-            if original_audio_clip:
-                vid_max_volume = original_audio_clip.max_volume()
-                still_frame_volume = original_audio_clip.subclip(max(ts_start_seconds - 5, 0), e_time).max_volume()
-                if vid_max_volume == 0:
-                    vid_max_volume = audio_clip.max_volume()
-                    still_frame_volume = vid_max_volume
-                max_audio_desc_volume = audio_clip.max_volume()
-                
-                logging.info(f"Calculated volumes: vid_max_volume={vid_max_volume}, max_audio_desc_volume={max_audio_desc_volume}, still_frame_volume={still_frame_volume}")
-                
-                if add_bg_music and bg_audio_category:
-                    music_path = bg_audio_generator.generate_music_from_collection(
-                        duration=int(audio_clip.duration)
-                    )
-                    logging.info(f"Generated background music: {music_path}")
-
-                    generated_music_clip = AudioFileClip(music_path)
-                    generated_music_clip_max_volume = generated_music_clip.max_volume()
-                    generated_music_clip = generated_music_clip.volumex((vid_max_volume/generated_music_clip_max_volume)*0.5).audio_fadein(fade_duration).volumex(0.12).audio_fadeout(fade_duration).volumex((vid_max_volume/generated_music_clip_max_volume)*3)
-                    
-                    combined_audio_clips = [still_clip.audio.volumex(vid_max_volume/max_audio_desc_volume), generated_music_clip.set_start(0)]
-                    if ts_start_seconds + bg_fade_duration < int(original_audio_clip.duration):
-                        logging.info(f"Fading out start audio original track from {ts_start_seconds} to {ts_start_seconds + bg_fade_duration}")
-                        faded_out_start_audio_original_track = original_audio_clip.subclip(ts_start_seconds, ts_start_seconds + bg_fade_duration).audio_fadeout(bg_fade_duration)
-                        combined_audio_clips.append(faded_out_start_audio_original_track.set_start(0))
-                    if ts_start_seconds > bg_fade_duration:
-                        logging.info(f"Fading in end audio original track from {ts_start_seconds - bg_fade_duration} to {ts_start_seconds}")
-                        faded_in_end_audio_original_track = original_audio_clip.subclip(ts_start_seconds - bg_fade_duration, ts_start_seconds).audio_fadein(bg_fade_duration)
-                        combined_audio_clips.append(faded_in_end_audio_original_track.set_start(audio_clip.duration - bg_fade_duration))
-
-                    combined_audio = CompositeAudioClip(combined_audio_clips)
-
-                else:
-                    combined_audio_clips = [still_clip.audio.volumex(vid_max_volume/max_audio_desc_volume)]
-                    if ts_start_seconds + bg_fade_duration < int(original_audio_clip.duration):
-                        logging.info(f"Fading out start audio original track from {ts_start_seconds} to {ts_start_seconds + bg_fade_duration}")
-                        faded_out_start_audio_original_track = original_audio_clip.subclip(ts_start_seconds, ts_start_seconds + bg_fade_duration).audio_fadeout(bg_fade_duration)
-                        combined_audio_clips.append(faded_out_start_audio_original_track.set_start(0))
-                    if ts_start_seconds > bg_fade_duration:
-                        logging.info(f"Fading in end audio original track from {ts_start_seconds - bg_fade_duration} to {ts_start_seconds}")
-                        faded_in_end_audio_original_track = original_audio_clip.subclip(ts_start_seconds - bg_fade_duration, ts_start_seconds).audio_fadein(bg_fade_duration)
-                        combined_audio_clips.append(faded_in_end_audio_original_track.set_start(audio_clip.duration - bg_fade_duration))
-
-                    
-                    combined_audio = CompositeAudioClip(combined_audio_clips)
-                
-
-                still_clip = still_clip.set_audio(combined_audio)
-                logging.info(f"Set combined audio for still clip")
-            
-            clips.append(still_clip)
-            logging.info(f"Added still clip to clips")
-
-        added_timestamps.add(start_timestamp)
-        last_end = still_frame_time
+        timeline.append(("segment", last_end, ts_start_seconds))
+        audio_pieces.append(slice_seconds(original_audio, last_end, ts_start_seconds))
+        logging.info(f"Added video segment from {last_end} to {ts_start_seconds}")
+
+        if ts_start_seconds == 0: 
+            e_time = ts_start_seconds + 5 
+        else:
+            e_time = ts_start_seconds
+
+        max_audio_desc_volume = peak(desc_audio)
+        clip_vid_max_volume = vid_max_volume
+        still_frame_volume = original_loudness.peak(max(ts_start_seconds - 5, 0), e_time)
+        if clip_vid_max_volume == 0:
+            clip_vid_max_volume = max_audio_desc_volume
+            still_frame_volume = clip_vid_max_volume
+        logging.info(f"Calculated volumes: vid_max_volume={clip_vid_max_volume}, max_audio_desc_volume={max_audio_desc_volume}, still_frame_volume={still_frame_volume}")
+
+        insert_audio = silence(desc_duration)
+        mix_into(insert_audio, apply_gain(desc_audio, normalization_gain(max_audio_desc_volume, clip_vid_max_volume)))
+
+        if bg_audio_generator is not None:
+            music_audio = bg_audio_generator.generate_music_from_collection(
+                duration=int(desc_duration)
+            )
+            logging.info(f"Background music excerpt of {duration_of(music_audio)} seconds from {bg_audio_generator.selected_file}")
+
+            music_ratio = normalization_gain(peak(music_audio), clip_vid_max_volume)
+            # Net gain of the former volumex(ratio * 0.5) -> volumex(0.12) -> volumex(ratio * 3) chain
+            music_gain = (music_ratio * 0.5) * 0.12 * (music_ratio * 3)
+            mix_into(insert_audio, apply_gain(music_audio, music_gain, fade_in=fade_duration, fade_out=fade_duration))
+
+        if ts_start_seconds + bg_fade_duration < int(original_audio_duration):
+            logging.info(f"Fading out start audio original track from {ts_start_seconds} to {ts_start_seconds + bg_fade_duration}")
+            faded_out_start = slice_seconds(original_audio, ts_start_seconds, ts_start_seconds + bg_fade_duration)
+            mix_into(insert_audio, apply_gain(faded_out_start, fade_out=bg_fade_duration))
+        if ts_start_seconds > bg_fade_duration:
+            logging.info(f"Fading in end audio original track from {ts_start_seconds - bg_fade_duration} to {ts_start_seconds}")
+            faded_in_end = slice_seconds(original_audio, ts_start_seconds - bg_fade_duration, ts_start_seconds)
+            mix_into(insert_audio, apply_gain(faded_in_end, fade_in=bg_fade_duration), offset=desc_duration - bg_fade_duration)
+
+        timeline.append(("still", still_frame.path, desc_duration))
+        audio_pieces.append(insert_audio)
+        logging.info(f"Created still clip with duration: {desc_duration}")
+
+        last_end = ts_start_seconds
         logging.info(f"Updated last_end to {last_end}")
 
-    if last_end < int(video.duration):
-        final_segment_end = int(video.duration)
-        final_segment = video.subclip(last_end, final_segment_end)
-        clips.append(final_segment)
+    if last_end < int(video_duration):
+        final_segment_end = int(video_duration)
+        timeline.append(("segment", last_end, final_segment_end))
+        audio_pieces.append(slice_seconds(original_audio, last_end, final_segment_end))
         logging.info(f"Added final video segment from {last_end} to {final_segment_end}")
 
-    final_clip = concatenate_videoclips(clips)
+    final_audio_path = write_wav(f"{render_dir}/final_audio.wav", audio_pieces)
+    del audio_pieces
+    logging.info(f"Mixed soundtrack written to {final_audio_path}")
+    report_progress(on_progress, "rendering", 60, "Rendering video... 0%")
+    reported = {"step": 0}
+
+    def on_render_progress(fraction):
+        # Reported in 5% steps so long videos don't turn every piece into a status write
+        step = int(fraction * 20)
+        if step > reported["step"]:
+            reported["step"] = step
+            report_progress(on_progress, "rendering", 60 + 30 * fraction, f"Rendering video... {step * 5}%")
+
+    if RENDER_MODE == "stream_copy":
+        try:
+            render_stream_copy(video_path, timeline, final_audio_path, output_path, render_dir, on_render_progress)
+            logging.info(f"Final video written to {output_path} using stream copy")
+            return
+        except StreamCopyUnsupported as e:
+            logging.warning(f"Stream copy not possible, falling back to full re-encode: {e}")
+        except Exception as e:
+            logging.error(f"Stream copy render failed, falling back to full re-encode: {e}")
+
     try:
-        final_clip.write_videofile(output_path, codec="libx264", audio_codec="aac")
+        final_duration = render_with_moviepy(video_path, timeline, final_audio_path, output_path)
         logging.info(f"Final video written to {output_path}")
     except Exception as e:
         logging.error(f"Error during final video writing: {e}")
         raise
 
-    logging.info(f"Final video created successfully. Duration: {final_clip.duration} seconds")
\ No newline at end of file
+    logging.info(f"Final video created successfully. Duration: {final_duration} seconds")
+
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+import uuid
+from google.api_core.exceptions import NotFound
+from util.Constants import BUCKET_NAME
+from util.gcs_bucket import get_bucket
+from util.lru_index import LRUIndex, remove_files
+from util.memory_budget import memory_budget
+from util.result_cache import result_cache_key
+
+# Narration as the TTS API returned it. Decoding a hit takes an ffmpeg pass, but MP3 is a twentieth
+# of the size of mixer-ready float32 PCM
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "temp/tts_cache")
+# At roughly 16 KB per second of speech, a sixteenth of a 512 MiB instance holds a few hundred lines
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(memory_budget(1 / 16))))
+# Optional second tier shared by all instances; its size is bounded by the bucket's lifecycle rules
+TTS_CACHE_GCS = os.getenv("TTS_CACHE_GCS", "false") == "true"
+TTS_CACHE_BUCKET = os.getenv("TTS_CACHE_BUCKET", BUCKET_NAME)
+TTS_CACHE_PREFIX = os.getenv("TTS_CACHE_PREFIX", "tts_cache/")
+
+
+def normalize_tts_text(text):
+    # Variants that sound the same share an entry: Unicode form and whitespace are normalized
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def tts_cache_key(voice_id, model_id, text):
+    return result_cache_key("tts", voice_id, model_id, normalize_tts_text(text))
+
+
+class TTSCache():
+    # Each entry is {key}.mp3 with the synthesized audio as served and {key}.json with duration and
+    # request metadata
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES, use_gcs=TTS_CACHE_GCS,
+                 bucket_name=TTS_CACHE_BUCKET, prefix=TTS_CACHE_PREFIX):
+        self.cache_dir = cache_dir
+        self.use_gcs = use_gcs
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.index = LRUIndex("TTS cache", max_bytes,
+                              lambda key: remove_files(self._audio_path(key), self._metadata_path(key)))
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index.scan(cache_dir, ".mp3", lambda key: os.path.exists(self._metadata_path(key)))
+
+    def _audio_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _metadata_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _get_local(self, key):
+        with self.lock:
+            if key not in self.index:
+                return None
+            self.index.touch(key)
+            try:
+                # Read under the lock so eviction can't delete the files in between
+                with open(self._audio_path(key), "rb") as f:
+                    data = f.read()
+                with open(self._metadata_path(key)) as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Dropping unreadable TTS cache entry {key}: {e}")
+                self.index.discard(key)
+                return None
+        return data, metadata
+
+    def _put_local(self, key, data, metadata):
+        # Written under temporary names and renamed into place, so readers never see partial entries
+        incoming = os.path.join(self.cache_dir, f".{uuid.uuid4()}")
+        with open(f"{incoming}.mp3", "wb") as f:
+            f.write(data)
+        with open(f"{incoming}.json", "w") as f:
+            json.dump(metadata, f)
+        with self.lock:
+            os.replace(f"{incoming}.json", self._metadata_path(key))
+            os.replace(f"{incoming}.mp3", self._audio_path(key))
+            self.index.track(key, len(data))
+            self.index.evict()
+
+    def _blob_name(self, key):
+        return f"{self.prefix}{key}.mp3"
+
+    def get(self, key):
+        # (MP3 bytes, metadata) or None; a GCS hit is copied into the local tier
+        entry = self._get_local(key)
+        if entry is not None or not self.use_gcs:
+            return entry
+        try:
+            # get_blob loads the object's custom metadata, a bare blob() would leave it empty
+            blob = get_bucket(self.bucket_name).get_blob(self._blob_name(key))
+            if blob is None or not blob.metadata or "tts" not in blob.metadata:
+                return None
+            metadata = json.loads(blob.metadata["tts"])
+            data = blob.download_as_bytes()
+        except NotFound:
+            return None
+        except Exception as e:
+            logging.warning(f"TTS cache GCS read failed for {key}: {e}")
+            return None
+        self._put_local(key, data, metadata)
+        return data, metadata
+
+    def put(self, key, data, metadata):
+        self._put_local(key, data, metadata)
+        if self.use_gcs:
+            try:
+                blob = get_bucket(self.bucket_name).blob(self._blob_name(key))
+                blob.metadata = {"tts": json.dumps(metadata)}
+                blob.upload_from_string(data, content_type="audio/mpeg")
+            except Exception as e:
+                logging.warning(f"TTS cache GCS write failed for {key}: {e}")
+
+
+_tts_cache = None
+_tts_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    global _tts_cache
+    if _tts_cache is None:
+        with _tts_cache_lock:
+            if _tts_cache is None:
+                _tts_cache = TTSCache()
+    return _tts_cache
@@ -0,0 +1,100 @@
+import base64
+import hashlib
+import logging
+import os
+import uuid
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, NeedData, Epilogue
+from werkzeug.utils import secure_filename
+from util.gcs_bucket import open_gcs_writer
+
+STREAM_READ_SIZE = 64 * 1024
+MAX_FORM_FIELD_SIZE = 64 * 1024
+
+
+def stream_multipart_upload(stream, content_type, bucket_name, file_field="file", local_dir="temp"):
+    # Parses the multipart body as it arrives and pipes the file part into a resumable GCS upload,
+    # teeing the same bytes into a local working copy, so memory per request stays at one read
+    # buffer plus the GCS chunk
+    mimetype, options = parse_options_header(content_type)
+    boundary = options.get("boundary")
+    if mimetype != "multipart/form-data" or not boundary:
+        raise ValueError("Expected a multipart/form-data request body")
+    # A fresh instance has no temp/ until the first job creates it
+    os.makedirs(local_dir, exist_ok=True)
+
+    decoder = MultipartDecoder(boundary.encode())
+    fields = {}
+    filename = None
+    local_path = None
+    size = 0
+    md5 = hashlib.md5()
+    field_name = None
+    field_data = bytearray()
+    writer = None
+    local_file = None
+    receiving_file = False
+
+    try:
+        finished = False
+        while not finished:
+            chunk = stream.read(STREAM_READ_SIZE)
+            decoder.receive_data(chunk or None)
+
+            event = decoder.next_event()
+            while not isinstance(event, NeedData):
+                if isinstance(event, Field):
+                    field_name = event.name
+                    field_data = bytearray()
+                    receiving_file = False
+                elif isinstance(event, File):
+                    field_name = None
+                    receiving_file = event.name == file_field and filename is None
+                    if receiving_file:
+                        filename = secure_filename(event.filename)
+                        if not filename:
+                            raise ValueError("Uploaded file has no usable filename")
+                        local_path = os.path.join(local_dir, f"upload_{uuid.uuid4()}_{filename}")
+                        local_file = open(local_path, "wb")
+                        writer = open_gcs_writer(bucket_name, filename, event.headers.get("Content-Type"))
+                elif isinstance(event, Data):
+                    if receiving_file:
+                        writer.write(event.data)
+                        local_file.write(event.data)
+                        md5.update(event.data)
+                        size += len(event.data)
+                        if not event.more_data:
+                            # Closing the writer finalizes the resumable upload
+                            writer.close()
+                            local_file.close()
+                            writer = None
+                            receiving_file = False
+                    elif field_name is not None:
+                        field_data += event.data
+                        if len(field_data) > MAX_FORM_FIELD_SIZE:
+                            raise ValueError(f"Form field '{field_name}' is too large")
+                        if not event.more_data:
+                            fields[field_name] = field_data.decode("utf-8", errors="replace")
+                            field_name = None
+                elif isinstance(event, Epilogue):
+                    finished = True
+                    break
+                event = decoder.next_event()
+
+            if not chunk and not finished:
+                raise ValueError("Request body ended before the multipart upload was complete")
+    except Exception:
+        # An unfinished resumable upload is never committed, only the local copy needs cleaning up
+        if local_file is not None:
+            local_file.close()
+        if local_path and os.path.exists(local_path):
+            os.remove(local_path)
+        raise
+
+    if filename is None:
+        raise ValueError(f"No '{file_field}' file part in the request")
+
+    logging.info(f"Streamed upload {filename} ({size} bytes) to {bucket_name} and {local_path}")
+    # Same encoding as Blob.md5_hash, so the local copy can be matched against the stored object
+    md5_hash = base64.b64encode(md5.digest()).decode()
+    return {"filename": filename, "fields": fields, "local_path": local_path, "size": size, "md5_hash": md5_hash}